@@ -2,8 +2,17 @@ import streamlit as st
 import logging
 from styles.css import get_css
 from styles.templates import get_title_section, get_sidebar_content
-from src.gpt_commands import generate_story, generate_story_stream
-from src.streamlit_components import render_story_parameters, render_story_output, render_story_generator
+from src.agents.state import StoryParameters
+from src.library import get_story_library
+from src.profiling import profiling_enabled
+from src.story_store import get_story_store
+from src.streamlit_components import (
+    render_story_parameters,
+    render_story_output,
+    render_story_generator,
+    render_story_history,
+    render_library_search
+)
 
 
 # Custom CSS
@@ -18,11 +27,43 @@ def get_stage_display(stage: str) -> tuple[str, str]:
         "writer": ("✍️", "Writing the story..."),
         "reviewer": ("🔍", "Reviewing for quality..."),
         "enhancer": ("✨", "Adding final polish..."),
+        "fallback": ("⚡", "Fetching a quick story..."),
+        "pool": ("⚡", "Your story is ready!"),
         "error": ("❌", "Oops! Something went wrong"),
     }
     return stages.get(stage, ("🔄", "Processing..."))
 
 
+@st.fragment(run_every=1.0)
+def render_generation_progress(store, show_progress: bool):
+    """Poll the background generation and show its progress."""
+    store.poll()
+    if not store.is_generating:
+        # Finished: rerun the whole page to render the story
+        st.rerun()
+    
+    task = store.active
+    if show_progress:
+        emoji, text = get_stage_display(task.stage)
+        st.info(f"{emoji} **{text}**")
+        # Show intermediate outputs
+        if task.plan:
+            plan = task.plan
+            with st.expander("📋 Story Plan", expanded=False):
+                st.write(f"**Title:** {plan.title}")
+                st.write(f"**Characters:** {', '.join(plan.main_characters)}")
+                st.write(f"**Setting:** {plan.setting_description}")
+    else:
+        st.info("🪄 **Weaving your magical bedtime story...**")
+    st.button("⏹️ Stop", on_click=store.cancel)
+
+
+@st.fragment(run_every=15.0)
+def keep_jobs_alive(store):
+    """Heartbeat for the prefetched next story while the page is open."""
+    store.heartbeat()
+
+
 def main():
     """Main function to run the Streamlit application."""
     
@@ -55,51 +96,56 @@ def main():
             value=True,
             help="Display agent progress during generation"
         ) if use_agents else False
+        # Per session: the choice is passed with each generation job
+        profile = st.toggle(
+            "🔬 Profile requests",
+            value=profiling_enabled(),
+            key="profile_requests",
+            help="Write a speedscope profile per generation to .story_data/profiles"
+        )
+    
+    # Stories live in session state so reruns (e.g. Save Story) keep them
+    store = get_story_store()
+    store.poll()
+    
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("### 📚 Story Library")
+        render_library_search(
+            search=lambda query, **filters: get_story_library().search(query, limit=10, **filters),
+            on_select=store.show_library_story
+        )
     
     # Main content
     col1, col2 = st.columns([1, 1.5])
     with col1:
         # Input parameters
         language, setting, moral, culture = render_story_parameters()
+        parameters = StoryParameters(
+            language=language,
+            setting=setting,
+            moral=moral,
+            culture=culture
+        )
     with col2:
         # Generate story button
         if render_story_generator():
-            if use_agents and show_progress:
-                # Streaming mode with progress display
-                progress_container = st.empty()
-                story_container = st.empty()
-                final_story = None
-                
-                with st.spinner("🪄 Weaving your magical bedtime story..."):
-                    for stage, state in generate_story_stream(language, setting, moral, culture):
-                        emoji, text = get_stage_display(stage)
-                        progress_container.info(f"{emoji} **{text}**")
-                        
-                        # Show intermediate outputs
-                        if stage == "planner" and state.get("plan"):
-                            plan = state["plan"]
-                            with st.expander("📋 Story Plan", expanded=False):
-                                st.write(f"**Title:** {plan.title}")
-                                st.write(f"**Characters:** {', '.join(plan.main_characters)}")
-                                st.write(f"**Setting:** {plan.setting_description}")
-                        
-                        if stage == "enhancer" and state.get("final_story"):
-                            final_story = state["final_story"]
-                
-                progress_container.empty()
-                
-                if final_story:
-                    render_story_output(final_story)
-                else:
-                    st.error("❌ Oops! Something went wrong. Let's try again!")
-            else:
-                # Simple mode
-                with st.spinner("🪄 Weaving your magical bedtime story..."):
-                    story = generate_story(language, setting, moral, culture, use_agents=use_agents)
-                    if story:
-                        render_story_output(story)
-                    else:
-                        st.error("❌ Oops! Something went wrong. Let's try again!")
+            store.generate(parameters, use_agents, profile=profile)
+        
+        if store.is_generating:
+            render_generation_progress(store, use_agents and show_progress)
+        elif store.last_error:
+            st.error("❌ Oops! Something went wrong. Let's try again!")
+        if store.prefetch_job_id and not store.is_generating:
+            keep_jobs_alive(store)
+        
+        if store.current and not store.is_generating:
+            render_story_output(
+                store.current.story,
+                on_new_story=store.next_story,
+                on_new_story_args=(parameters, use_agents, profile)
+            )
+        render_story_history(store.history, on_select=store.select)
 
 
 if __name__ == "__main__":
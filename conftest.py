@@ -0,0 +1 @@
+# Makes the repository root importable (``src``) when running plain ``pytest``.
@@ -1,12 +1,17 @@
 """LangGraph workflow for story generation."""
 import functools
+import logging
 from typing import Optional
 
 from langgraph.graph import StateGraph, END
 
+from src.llm import CancelToken, GenerationCancelled, get_cancellation_stats
+from src.llm.length_control import get_length_controller
 from .state import GraphState, StoryParameters
 from .nodes import plan_story, write_story, review_story, enhance_story
 
+PIPELINE_STAGES = ("planner", "writer", "reviewer", "enhancer")
+
 
 def should_revise(state: GraphState) -> str:
     """Conditional edge: determine if story needs revision."""
@@ -21,14 +26,21 @@ def should_revise(state: GraphState) -> str:
         return "revise"
 
 
-def create_story_graph(api_key: str) -> StateGraph:
+def continue_unless_error(next_node: str):
+    """Conditional edge: stop the pipeline once a node has failed."""
+    def route(state: GraphState) -> str:
+        return "stop" if state.get("error") else next_node
+    return route
+
+
+def create_story_graph(api_key: str, cancel_token: Optional[CancelToken] = None) -> StateGraph:
     """Create and compile the story generation graph."""
     
-    # Bind api_key to node functions
-    plan_node = functools.partial(plan_story, api_key=api_key)
-    write_node = functools.partial(write_story, api_key=api_key)
-    review_node = functools.partial(review_story, api_key=api_key)
-    enhance_node = functools.partial(enhance_story, api_key=api_key)
+    # Bind api_key and the cancel token to node functions
+    plan_node = functools.partial(plan_story, api_key=api_key, cancel_token=cancel_token)
+    write_node = functools.partial(write_story, api_key=api_key, cancel_token=cancel_token)
+    review_node = functools.partial(review_story, api_key=api_key, cancel_token=cancel_token)
+    enhance_node = functools.partial(enhance_story, api_key=api_key, cancel_token=cancel_token)
     
     # Create the graph
     workflow = StateGraph(GraphState)
@@ -41,8 +53,17 @@ def create_story_graph(api_key: str) -> StateGraph:
     
     # Define edges
     workflow.set_entry_point("planner")
-    workflow.add_edge("planner", "writer")
-    workflow.add_edge("writer", "reviewer")
+    # A failed plan or draft ends the run; callers fall back to simple mode
+    workflow.add_conditional_edges(
+        "planner",
+        continue_unless_error("writer"),
+        {"writer": "writer", "stop": END}
+    )
+    workflow.add_conditional_edges(
+        "writer",
+        continue_unless_error("reviewer"),
+        {"reviewer": "reviewer", "stop": END}
+    )
     
     # Conditional edge from reviewer
     workflow.add_conditional_edges(
@@ -59,12 +80,23 @@ def create_story_graph(api_key: str) -> StateGraph:
     return workflow.compile()
 
 
+def record_cancellation(language: str, last_stage: Optional[str]) -> None:
+    """Count a generation cancelled after last_stage and the output it did not produce."""
+    done = PIPELINE_STAGES.index(last_stage) + 1 if last_stage in PIPELINE_STAGES else 0
+    controller = get_length_controller()
+    tokens_saved = sum(controller.expected_tokens(language, stage) for stage in PIPELINE_STAGES[done:])
+    stage = PIPELINE_STAGES[done] if done < len(PIPELINE_STAGES) else "complete"
+    get_cancellation_stats().record_cancelled(stage, tokens_saved)
+    logging.info(f"Story generation cancelled during {stage}")
+
+
 def generate_story_with_agents(
     language: str,
     setting: str,
     moral: str,
     culture: str,
-    api_key: str
+    api_key: str,
+    cancel_token: Optional[CancelToken] = None
 ) -> Optional[str]:
     """
     Generate a bedtime story using the multi-agent pipeline.
@@ -75,13 +107,17 @@ def generate_story_with_agents(
         moral: Moral lesson to convey
         culture: Cultural context
         api_key: OpenAI API key
+        cancel_token: Aborts the pipeline and its in-flight LLM calls when cancelled
     
     Returns:
         Generated story text or None if generation fails
+    
+    Raises:
+        GenerationCancelled: If cancel_token is cancelled before the story is done
     """
     try:
         # Create the graph
-        graph = create_story_graph(api_key)
+        graph = create_story_graph(api_key, cancel_token)
         
         # Initialize state
         initial_state: GraphState = {
@@ -93,6 +129,7 @@ def generate_story_with_agents(
             ),
             "plan": None,
             "draft": None,
+            "draft_model": None,
             "review": None,
             "final_story": None,
             "current_stage": "starting",
@@ -108,7 +145,6 @@ def generate_story_with_agents(
         return final_state.get("final_story")
     
     except Exception as e:
-        import logging
         logging.error(f"Error in story generation: {str(e)}")
         return None
 
@@ -118,7 +154,8 @@ def generate_story_with_streaming(
     setting: str,
     moral: str,
     culture: str,
-    api_key: str
+    api_key: str,
+    cancel_token: Optional[CancelToken] = None
 ):
     """
     Generate a bedtime story with intermediate state streaming.
@@ -131,12 +168,17 @@ def generate_story_with_streaming(
         moral: Moral lesson
         culture: Cultural context
         api_key: OpenAI API key
+        cancel_token: Aborts the pipeline and its in-flight LLM calls when cancelled
     
     Yields:
         Tuple of (stage_name, state_dict)
+    
+    Raises:
+        GenerationCancelled: If cancel_token is cancelled before the story is done
     """
+    last_stage = None
     try:
-        graph = create_story_graph(api_key)
+        graph = create_story_graph(api_key, cancel_token)
         
         initial_state: GraphState = {
             "parameters": StoryParameters(
@@ -147,6 +189,7 @@ def generate_story_with_streaming(
             ),
             "plan": None,
             "draft": None,
+            "draft_model": None,
             "review": None,
             "final_story": None,
             "current_stage": "starting",
@@ -157,9 +200,14 @@ def generate_story_with_streaming(
         for state in graph.stream(initial_state):
             # state is a dict with node name as key
             for node_name, node_state in state.items():
+                last_stage = node_name
                 yield (node_name, node_state)
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
     
+    except GenerationCancelled:
+        record_cancellation(language, last_stage)
+        raise
     except Exception as e:
-        import logging
         logging.error(f"Error in streaming story generation: {str(e)}")
         yield ("error", {"error": str(e)})
@@ -1,78 +1,199 @@
 """Agent node functions for the story generation graph."""
 import json
 import logging
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from typing import Optional
+from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
 
-from .state import GraphState, StoryPlan, ReviewFeedback
+from src.llm import (
+    SERVED_MODEL, CancelToken, GenerationCancelled, RoutedChatModel, attempt_timeout, call_llm, get_router
+)
+from src.llm.length_control import count_words, get_length_controller, trim_to_sentence
+from .state import GraphState, StoryParameters, StoryPlan, ReviewFeedback
+from .review_policy import get_review_policy
 from .prompts import (
     PLANNER_SYSTEM_PROMPT,
+    PLANNER_USER_PROMPT,
     WRITER_SYSTEM_PROMPT,
+    WRITER_USER_PROMPT,
+    WRITER_REVISION_CONTEXT,
     REVIEWER_SYSTEM_PROMPT,
-    ENHANCER_SYSTEM_PROMPT
+    REVIEWER_USER_PROMPT,
+    ENHANCER_SYSTEM_PROMPT,
+    BOTH_SETTING_REQUIREMENTS,
+    HINGLISH_LANGUAGE_REQUIREMENTS,
+    PROMPT_VERSION
 )
 
 
-def get_llm(api_key: str, model: str = "gpt-5-mini", temperature: float = 0.7) -> ChatOpenAI:
-    """Get a configured LLM instance."""
-    return ChatOpenAI(
+def get_llm(
+    api_key: str,
+    model: str = "gpt-5-mini",
+    temperature: float = 0.7,
+    max_tokens: Optional[int] = None,
+    cancel_token: Optional[CancelToken] = None,
+    label: str = "default"
+) -> RoutedChatModel:
+    """Get a configured LLM, routed across the configured provider endpoints."""
+    return RoutedChatModel(
+        get_router(),
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
         api_key=api_key,
+        cancel_token=cancel_token,
+        label=label,
+        stream_usage=True,
+        timeout=attempt_timeout()
+    )
+
+
+def get_node_llm(
+    api_key: str,
+    node: str,
+    language: str,
+    temperature: float,
+    cancel_token: Optional[CancelToken] = None
+) -> RoutedChatModel:
+    """Get an LLM whose output cap is sized for this node, language and model."""
+    model = "gpt-5-mini"
+    max_tokens = get_length_controller().max_tokens(language, node, model)
+    return get_llm(
+        api_key,
         model=model,
-        temperature=temperature
+        temperature=temperature,
+        max_tokens=max_tokens,
+        cancel_token=cancel_token,
+        label=node
     )
 
 
+def _describe_request(llm: RoutedChatModel, messages: list) -> dict:
+    """Cassette fingerprint of a call.
+
+    Leaves out max_tokens, which follows the learned (and saved) length
+    stats and would stop recorded requests matching on replay.
+    """
+    return {
+        "model": llm.model_name,
+        "temperature": llm.temperature,
+        "messages": [{"role": m.type, "content": m.content} for m in messages]
+    }
+
+
+def _visible_output_tokens(usage: Optional[dict]) -> Optional[int]:
+    """Output tokens excluding reasoning tokens, which produce no text."""
+    if not usage:
+        return None
+    reasoning = (usage.get("output_token_details") or {}).get("reasoning") or 0
+    return usage.get("output_tokens", 0) - reasoning
+
+
+def invoke_llm(llm: RoutedChatModel, messages: list, label: str, cancel_token: Optional[CancelToken] = None):
+    """Invoke the LLM through the shared (hedged) call layer."""
+    request = _describe_request(llm, messages)
+    return call_llm(
+        lambda attempt_token: llm.invoke(messages, cancel_token=attempt_token),
+        label=label,
+        request=request,
+        cancel_token=cancel_token
+    )
+
+
+def stream_llm(
+    llm: RoutedChatModel,
+    messages: list,
+    label: str,
+    language: str,
+    cancel_token: Optional[CancelToken] = None
+) -> AIMessage:
+    """
+    Stream a story-producing call, cutting it off once it overshoots the word limit.
+    
+    Stopping the stream closes the HTTP response, so runaway generations stop
+    costing tokens. Outputs that finish normally feed the language's
+    tokens-per-word estimate.
+    """
+    controller = get_length_controller()
+    word_limit = controller.word_limit(label)
+    
+    def send(attempt_token: CancelToken) -> AIMessage:
+        text = ""
+        usage = None
+        served_model = None
+        cut_off = False
+        stream = llm.stream(messages, cancel_token=attempt_token)
+        try:
+            for chunk in stream:
+                if attempt_token.cancelled:
+                    break
+                if chunk.usage_metadata:
+                    usage = chunk.usage_metadata
+                served_model = served_model or chunk.response_metadata.get(SERVED_MODEL)
+                if isinstance(chunk.content, str) and chunk.content:
+                    text += chunk.content
+                    if any(c.isspace() for c in chunk.content) and count_words(text) > word_limit:
+                        cut_off = True
+                        break
+        except Exception as e:
+            # An aborted connection surfaces as a transport error
+            if attempt_token.cancelled:
+                raise GenerationCancelled(attempt_token.reason) from e
+            raise
+        finally:
+            stream.close()
+        attempt_token.raise_if_cancelled()
+        if cut_off:
+            logging.info(f"Cutting off '{label}' output past {word_limit} words")
+            controller.record_cutoff()
+            # Trim back to the budget the reviewer checks, not just the cut-off point
+            text = trim_to_sentence(text, controller.word_budget(label))
+        return AIMessage(
+            content=text,
+            usage_metadata=usage,
+            response_metadata={"cut_off": cut_off, SERVED_MODEL: served_model or llm.model_name}
+        )
+    
+    response = call_llm(send, label=label, request=_describe_request(llm, messages), cancel_token=cancel_token)
+    if not response.response_metadata.get("cut_off"):
+        controller.observe(language, response.content, _visible_output_tokens(response.usage_metadata))
+    return response
+
+
 def get_setting_requirements(setting: str) -> str:
     """Get specific requirements based on story setting."""
     if setting == "Both People & Animals":
-        return """
-Setting Requirements:
-- Include at least one human character and one animal character as main characters
-- Create meaningful interaction between the human and animal character
-- Both the human and animal should contribute to the story's resolution"""
+        return BOTH_SETTING_REQUIREMENTS
     return ""
 
 
 def get_language_requirements(language: str) -> str:
     """Get language-specific requirements."""
     if language.lower() == "hinglish":
-        return """
-Language Requirements:
-- Write the ENTIRE story in Hinglish using Roman script
-- Both narrative parts and dialogues should be in Hinglish
-- Use natural Hindi-English word mixing that Indian children commonly use
-- Example: "Ek time ki baat hai, jab ek chota sa boy Rahul apne grandparents ke ghar gaya."
-"""
+        return HINGLISH_LANGUAGE_REQUIREMENTS
     return ""
 
 
-def plan_story(state: GraphState, api_key: str) -> dict:
+def plan_story(state: GraphState, api_key: str, cancel_token: Optional[CancelToken] = None) -> dict:
     """Planner agent: Creates story outline and character profiles."""
     try:
         params = state["parameters"]
-        llm = get_llm(api_key, temperature=0.8)
+        llm = get_node_llm(api_key, "planner", params.language, temperature=0.8, cancel_token=cancel_token)
         
-        user_prompt = f"""Create a story plan with these parameters:
-Language: {params.language}
-Setting: {params.setting}
-Moral: {params.moral}
-Cultural Context: {params.culture}
-{get_setting_requirements(params.setting)}
-{get_language_requirements(params.language)}
-
-Respond with a JSON object containing:
-- title: string
-- main_characters: array of character descriptions
-- setting_description: string
-- plot_outline: string with beginning, middle, end
-- moral_integration: how the moral will emerge naturally"""
+        user_prompt = PLANNER_USER_PROMPT.format(
+            language=params.language,
+            setting=params.setting,
+            moral=params.moral,
+            culture=params.culture,
+            setting_requirements=get_setting_requirements(params.setting),
+            language_requirements=get_language_requirements(params.language)
+        )
 
         messages = [
             SystemMessage(content=PLANNER_SYSTEM_PROMPT),
             HumanMessage(content=user_prompt)
         ]
         
-        response = llm.invoke(messages)
+        response = invoke_llm(llm, messages, label="planner", cancel_token=cancel_token)
         content = response.content
         
         # Parse JSON from response
@@ -96,46 +217,40 @@ Respond with a JSON object containing:
         }
 
 
-def write_story(state: GraphState, api_key: str) -> dict:
+def write_story(state: GraphState, api_key: str, cancel_token: Optional[CancelToken] = None) -> dict:
     """Writer agent: Generates the full story based on the plan."""
     try:
         params = state["parameters"]
         plan = state["plan"]
         review = state.get("review")
-        llm = get_llm(api_key, temperature=0.7)
+        llm = get_node_llm(api_key, "writer", params.language, temperature=0.7, cancel_token=cancel_token)
         
         revision_context = ""
         if review and not review.approved:
-            revision_context = f"""
-REVISION NEEDED - Previous feedback:
-{review.feedback}
-
-Please address this feedback while writing the story."""
+            revision_context = WRITER_REVISION_CONTEXT.format(feedback=review.feedback)
         
-        user_prompt = f"""Write a bedtime story based on this plan:
-
-Title: {plan.title}
-Characters: {', '.join(plan.main_characters)}
-Setting: {plan.setting_description}
-Plot: {plan.plot_outline}
-Moral Integration: {plan.moral_integration}
-
-Language: {params.language}
-Cultural Context: {params.culture}
-{get_language_requirements(params.language)}
-{revision_context}
-
-Write the complete story now (250-350 words)."""
+        user_prompt = WRITER_USER_PROMPT.format(
+            title=plan.title,
+            characters=', '.join(plan.main_characters),
+            setting_description=plan.setting_description,
+            plot_outline=plan.plot_outline,
+            moral_integration=plan.moral_integration,
+            language=params.language,
+            culture=params.culture,
+            language_requirements=get_language_requirements(params.language),
+            revision_context=revision_context
+        )
 
         messages = [
             SystemMessage(content=WRITER_SYSTEM_PROMPT),
             HumanMessage(content=user_prompt)
         ]
         
-        response = llm.invoke(messages)
+        response = stream_llm(llm, messages, label="writer", language=params.language, cancel_token=cancel_token)
         
         return {
             "draft": response.content,
+            "draft_model": serving_model(llm, response),
             "current_stage": "written"
         }
     except Exception as e:
@@ -146,7 +261,26 @@ Write the complete story now (250-350 words)."""
         }
 
 
-def review_story(state: GraphState, api_key: str) -> dict:
+def serving_model(llm: RoutedChatModel, response) -> str:
+    """Model of the endpoint that served a response; replayed responses fall back to the requested one."""
+    return response.response_metadata.get(SERVED_MODEL) or llm.model_name
+
+
+def review_stats_model(draft_model: str, reviewer_model: str) -> str:
+    """Key review statistics by the models that wrote and judged the draft."""
+    return draft_model if draft_model == reviewer_model else f"{draft_model} reviewed by {reviewer_model}"
+
+
+def first_pass_review_decision(params: StoryParameters, model: str) -> str:
+    """Whether to review, audit or skip a first draft; reviews if the policy fails."""
+    try:
+        return get_review_policy().decide(params, model, PROMPT_VERSION)
+    except Exception as e:
+        logging.error(f"Error in review policy: {str(e)}")
+        return "review"
+
+
+def review_story(state: GraphState, api_key: str, cancel_token: Optional[CancelToken] = None) -> dict:
     """Reviewer agent: Evaluates story quality and provides feedback."""
     try:
         params = state["parameters"]
@@ -154,39 +288,44 @@ def review_story(state: GraphState, api_key: str) -> dict:
         current_review = state.get("review")
         revision_count = current_review.revision_count if current_review else 0
         
-        llm = get_llm(api_key, temperature=0.3)  # Lower temperature for consistent evaluation
+        # Lower temperature for consistent evaluation
+        llm = get_node_llm(api_key, "reviewer", params.language, temperature=0.3, cancel_token=cancel_token)
         
-        user_prompt = f"""Review this bedtime story:
-
----
-{draft}
----
-
-Story Parameters:
-- Language: {params.language}
-- Setting: {params.setting}
-- Moral: {params.moral}
-- Culture: {params.culture}
-
-Current revision count: {revision_count}
-
-Respond with a JSON object:
-{{
-    "approved": boolean,
-    "age_appropriate": boolean,
-    "moral_clarity": boolean,
-    "length_ok": boolean,
-    "feedback": "specific feedback if not approved, or brief praise if approved"
-}}
-
-Note: You MUST approve after 2 revision attempts to avoid endless loops."""
+        # First drafts of combinations that are almost always approved skip review.
+        # Endpoints may serve other models than requested, so stats are keyed by
+        # the draft's model and the reviewer's expected (later: actual) one
+        draft_model = state.get("draft_model") or llm.model_name
+        decision = None
+        if revision_count == 0:
+            decision = first_pass_review_decision(params, review_stats_model(draft_model, llm.expected_model()))
+        if decision == "skip":
+            return {
+                "review": ReviewFeedback(
+                    approved=True,
+                    age_appropriate=True,
+                    moral_clarity=True,
+                    length_ok=True,
+                    feedback="Review skipped: first drafts for these parameters are consistently approved.",
+                    revision_count=1
+                ),
+                "current_stage": "reviewed"
+            }
+        
+        user_prompt = REVIEWER_USER_PROMPT.format(
+            draft=draft,
+            language=params.language,
+            setting=params.setting,
+            moral=params.moral,
+            culture=params.culture,
+            revision_count=revision_count
+        )
 
         messages = [
             SystemMessage(content=REVIEWER_SYSTEM_PROMPT),
             HumanMessage(content=user_prompt)
         ]
         
-        response = llm.invoke(messages)
+        response = invoke_llm(llm, messages, label="reviewer", cancel_token=cancel_token)
         content = response.content
         
         # Parse JSON from response
@@ -198,6 +337,16 @@ Note: You MUST approve after 2 revision attempts to avoid endless loops."""
         review_data = json.loads(content.strip())
         review_data["revision_count"] = revision_count + 1
         
+        if decision is not None:
+            try:
+                get_review_policy().record(
+                    params, review_stats_model(draft_model, serving_model(llm, response)), PROMPT_VERSION,
+                    approved=bool(review_data.get("approved")),
+                    audited=decision == "audit"
+                )
+            except Exception as e:
+                logging.error(f"Error recording review outcome: {str(e)}")
+        
         # Force approval after 2 attempts
         if revision_count >= 2:
             review_data["approved"] = True
@@ -225,12 +374,12 @@ Note: You MUST approve after 2 revision attempts to avoid endless loops."""
         }
 
 
-def enhance_story(state: GraphState, api_key: str) -> dict:
+def enhance_story(state: GraphState, api_key: str, cancel_token: Optional[CancelToken] = None) -> dict:
     """Enhancer agent: Polishes the approved story."""
     try:
         params = state["parameters"]
         draft = state["draft"]
-        llm = get_llm(api_key, temperature=0.5)
+        llm = get_node_llm(api_key, "enhancer", params.language, temperature=0.5, cancel_token=cancel_token)
         
         user_prompt = f"""Polish this approved bedtime story with subtle enhancements:
 
@@ -249,7 +398,7 @@ Return ONLY the enhanced story, nothing else."""
             HumanMessage(content=user_prompt)
         ]
         
-        response = llm.invoke(messages)
+        response = stream_llm(llm, messages, label="enhancer", language=params.language, cancel_token=cancel_token)
         
         return {
             "final_story": response.content,
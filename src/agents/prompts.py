@@ -1,4 +1,5 @@
 """Prompts for each agent in the story generation pipeline."""
+import hashlib
 
 PLANNER_SYSTEM_PROMPT = """You are a creative children's story planner. Your job is to create a detailed outline for a bedtime story.
 
@@ -93,3 +94,88 @@ DO NOT:
 - Add scary or exciting elements
 
 For Hinglish stories, ensure consistent language mixing throughout."""
+
+# User prompts, filled in with str.format by the agent nodes
+PLANNER_USER_PROMPT = """Create a story plan with these parameters:
+Language: {language}
+Setting: {setting}
+Moral: {moral}
+Cultural Context: {culture}
+{setting_requirements}
+{language_requirements}
+
+Respond with a JSON object containing:
+- title: string
+- main_characters: array of character descriptions
+- setting_description: string
+- plot_outline: string with beginning, middle, end
+- moral_integration: how the moral will emerge naturally"""
+
+WRITER_REVISION_CONTEXT = """
+REVISION NEEDED - Previous feedback:
+{feedback}
+
+Please address this feedback while writing the story."""
+
+WRITER_USER_PROMPT = """Write a bedtime story based on this plan:
+
+Title: {title}
+Characters: {characters}
+Setting: {setting_description}
+Plot: {plot_outline}
+Moral Integration: {moral_integration}
+
+Language: {language}
+Cultural Context: {culture}
+{language_requirements}
+{revision_context}
+
+Write the complete story now (250-350 words)."""
+
+REVIEWER_USER_PROMPT = """Review this bedtime story:
+
+---
+{draft}
+---
+
+Story Parameters:
+- Language: {language}
+- Setting: {setting}
+- Moral: {moral}
+- Culture: {culture}
+
+Current revision count: {revision_count}
+
+Respond with a JSON object:
+{{
+    "approved": boolean,
+    "age_appropriate": boolean,
+    "moral_clarity": boolean,
+    "length_ok": boolean,
+    "feedback": "specific feedback if not approved, or brief praise if approved"
+}}
+
+Note: You MUST approve after 2 revision attempts to avoid endless loops."""
+
+BOTH_SETTING_REQUIREMENTS = """
+Setting Requirements:
+- Include at least one human character and one animal character as main characters
+- Create meaningful interaction between the human and animal character
+- Both the human and animal should contribute to the story's resolution"""
+
+HINGLISH_LANGUAGE_REQUIREMENTS = """
+Language Requirements:
+- Write the ENTIRE story in Hinglish using Roman script
+- Both narrative parts and dialogues should be in Hinglish
+- Use natural Hindi-English word mixing that Indian children commonly use
+- Example: "Ek time ki baat hai, jab ek chota sa boy Rahul apne grandparents ke ghar gaya."
+"""
+
+# Identifies the prompts (system and user) that shape a first draft and its
+# review; review statistics gathered under other prompts do not carry over
+PROMPT_VERSION = hashlib.sha256("\0".join((
+    PLANNER_SYSTEM_PROMPT, PLANNER_USER_PROMPT,
+    WRITER_SYSTEM_PROMPT, WRITER_USER_PROMPT, WRITER_REVISION_CONTEXT,
+    REVIEWER_SYSTEM_PROMPT, REVIEWER_USER_PROMPT,
+    BOTH_SETTING_REQUIREMENTS, HINGLISH_LANGUAGE_REQUIREMENTS,
+)).encode("utf-8")).hexdigest()[:12]
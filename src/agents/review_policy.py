@@ -0,0 +1,202 @@
+"""Adaptive sampling of first-pass story reviews.
+
+For many parameter combinations the reviewer approves the first draft
+almost every time, so the review call adds latency and cost without
+changing the outcome. This module records every first-pass verdict, keyed
+by parameters, model and prompt version, and skips the review once a
+combination's recent approval rate is above a threshold. A fixed fraction
+of those drafts is still reviewed as an audit. Audit verdicts feed the same
+rolling window, and a low approval rate among recent audits alone stops
+skipping, so full reviews resume on their own if quality drifts.
+"""
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from pydantic import BaseModel, Field
+
+from src.storage import data_path
+from .state import StoryParameters
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_outcomes (
+    id INTEGER PRIMARY KEY,
+    params TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    approved INTEGER NOT NULL,
+    audited INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS review_outcomes_key
+    ON review_outcomes (params, model, prompt_version, id);
+"""
+
+
+class ReviewPolicyConfig(BaseModel):
+    """Tuning knobs for review sampling."""
+    enabled: bool = Field(default=True, description="Whether first-pass reviews may be skipped at all")
+    approval_threshold: float = Field(default=0.9, description="Skip reviews when the recent first-pass approval rate is at least this")
+    min_samples: int = Field(default=20, description="First-pass reviews needed before a combination can be skipped")
+    window: int = Field(default=100, description="Number of most recent first-pass reviews the rate is computed over")
+    audit_fraction: float = Field(default=0.1, description="Share of skippable drafts that are still reviewed")
+    min_audits: int = Field(default=5, description="Audits in the window before their own approval rate can stop skipping")
+
+
+class ApprovalStats(BaseModel):
+    """First-pass review outcomes of one parameters/model/prompt combination."""
+    reviews: int = Field(description="First-pass reviews in the rolling window")
+    approved: int = Field(description="How many of those were approved")
+    audits: int = Field(default=0, description="Audit reviews in the window")
+    audits_approved: int = Field(default=0, description="How many of those were approved")
+
+    @property
+    def approval_rate(self) -> float:
+        return self.approved / self.reviews if self.reviews else 0.0
+
+    @property
+    def audit_approval_rate(self) -> float:
+        return self.audits_approved / self.audits if self.audits else 0.0
+
+
+def params_label(parameters: StoryParameters) -> str:
+    return "|".join((parameters.language, parameters.setting, parameters.moral, parameters.culture))
+
+
+class ReviewPolicy:
+    """Decides whether a first draft gets an LLM review, and learns from the verdicts."""
+
+    def __init__(self, db_path: Optional[str] = None, config: Optional[ReviewPolicyConfig] = None):
+        self.db_path = str(db_path or data_path("review_stats.sqlite3"))
+        self.config = config or ReviewPolicyConfig()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reviewed = 0
+        self._audited = 0
+        self._skipped = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        yield conn
+
+    def stats(self, parameters: StoryParameters, model: str, prompt_version: str) -> ApprovalStats:
+        """Approval counts over the rolling window for one combination."""
+        with self._connect() as conn:
+            reviews, approved, audits, audits_approved = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(approved), 0), "
+                "COALESCE(SUM(audited), 0), COALESCE(SUM(audited * approved), 0) FROM ("
+                "SELECT approved, audited FROM review_outcomes "
+                "WHERE params = ? AND model = ? AND prompt_version = ? "
+                "ORDER BY id DESC LIMIT ?)",
+                (params_label(parameters), model, prompt_version, self.config.window)
+            ).fetchone()
+        return ApprovalStats(reviews=reviews, approved=approved, audits=audits, audits_approved=audits_approved)
+
+    def decide(self, parameters: StoryParameters, model: str, prompt_version: str) -> str:
+        """
+        Decide how to handle a first draft.
+
+        Returns:
+            "review" for a regular review, "audit" for a sampled review of a
+            combination that would otherwise be skipped, or "skip"
+        """
+        decision = "review"
+        if self.config.enabled:
+            stats = self.stats(parameters, model, prompt_version)
+            skippable = (
+                stats.reviews >= self.config.min_samples
+                and stats.approval_rate >= self.config.approval_threshold
+            )
+            # While skipping only audits are recorded, so react to them directly
+            if stats.audits >= self.config.min_audits and stats.audit_approval_rate < self.config.approval_threshold:
+                skippable = False
+            if skippable:
+                decision = "audit" if random.random() < self.config.audit_fraction else "skip"
+        with self._lock:
+            if decision == "skip":
+                self._skipped += 1
+            elif decision == "audit":
+                self._audited += 1
+            else:
+                self._reviewed += 1
+        return decision
+
+    def record(
+        self,
+        parameters: StoryParameters,
+        model: str,
+        prompt_version: str,
+        approved: bool,
+        audited: bool = False
+    ) -> None:
+        """Store the verdict of a first-pass review."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO review_outcomes (params, model, prompt_version, approved, audited, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (params_label(parameters), model, prompt_version, int(approved), int(audited), time.time())
+            )
+
+    def drift(self, prompt_version: Optional[str] = None) -> dict[str, dict]:
+        """
+        Audit approval rate against the regular-review rate per combination.
+
+        A positive drift means audited drafts are approved less often than
+        the history that made the combination skippable.
+        """
+        where, args = ("WHERE prompt_version = ?", (prompt_version,)) if prompt_version else ("", ())
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT params, model, prompt_version, "
+                "SUM(audited = 0), SUM(CASE WHEN audited = 0 THEN approved ELSE 0 END), "
+                "SUM(audited), SUM(CASE WHEN audited = 1 THEN approved ELSE 0 END) "
+                f"FROM review_outcomes {where} GROUP BY params, model, prompt_version HAVING SUM(audited) > 0",
+                args
+            ).fetchall()
+        result = {}
+        for params, model, version, reviews, approved, audits, audits_approved in rows:
+            baseline = approved / reviews if reviews else 0.0
+            audit_rate = audits_approved / audits
+            result[f"{params}|{model}|{version}"] = {
+                "baseline_rate": round(baseline, 3),
+                "audits": audits,
+                "audit_rate": round(audit_rate, 3),
+                "drift": round(baseline - audit_rate, 3),
+            }
+        return result
+
+    def metrics(self) -> dict:
+        drift = self.drift()
+        with self._lock:
+            decisions = self._reviewed + self._audited + self._skipped
+            return {
+                "reviewed": self._reviewed,
+                "audited": self._audited,
+                "skipped": self._skipped,
+                "saved_calls": self._skipped,
+                "skip_rate": self._skipped / decisions if decisions else 0.0,
+                "quality_drift": drift,
+            }
+
+
+_policy: Optional[ReviewPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_review_policy() -> ReviewPolicy:
+    """Return the process-wide review policy."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = ReviewPolicy()
+        return _policy
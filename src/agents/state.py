@@ -39,6 +39,7 @@ class GraphState(TypedDict):
     # Intermediate states
     plan: Optional[StoryPlan]
     draft: Optional[str]
+    draft_model: Optional[str]
     review: Optional[ReviewFeedback]
     
     # Output
@@ -0,0 +1,208 @@
+"""Append-only, dictionary-compressed story archive with memory-mapped reads.
+
+Story records (parameters, plans, drafts, reviews, finals) are highly
+repetitive, so each record is compressed on its own against a dictionary
+trained on the corpus: records stay individually addressable while most of
+the shared phrasing costs almost nothing.
+
+Layout for an archive at ``path``:
+    path.dat  header (magic, codec, dictionary) followed by compressed records
+    path.idx  fixed-width entries (offset u64, length u32), one per record
+
+Reads memory-map both files; record i is located with one struct unpack
+on the index and decompressed straight from the mapped data without an
+intermediate copy. Uses zstandard when it is installed and falls back to
+zlib with a preset dictionary otherwise. Writes assume a single writer.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import Counter
+from typing import Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+_MAGIC = b"STARCH1\0"
+_HEADER = struct.Struct("<8sBI")  # magic, codec, dictionary length
+_ENTRY = struct.Struct("<QI")  # record offset, compressed length
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+# zlib only looks back 32 KiB, so a larger preset dictionary is wasted
+_ZLIB_DICT_SIZE = 32 * 1024
+
+
+def _train_zlib_dictionary(samples: list[bytes], size: int = _ZLIB_DICT_SIZE) -> bytes:
+    """Build a preset dictionary from the most frequent word 4-grams."""
+    counts: Counter = Counter()
+    for sample in samples:
+        words = sample.split()
+        for i in range(len(words) - 3):
+            counts[b" ".join(words[i:i + 4])] += 1
+    # Most frequent phrases go last, where deflate reaches them with the shortest distances
+    phrases = [p for p, n in counts.most_common() if n > 1]
+    chosen, total = [], 0
+    for phrase in phrases:
+        if total + len(phrase) + 1 > size:
+            break
+        chosen.append(phrase)
+        total += len(phrase) + 1
+    return b" ".join(reversed(chosen))
+
+
+def train_dictionary(samples: list[bytes], codec: int, dict_size: int = 64 * 1024) -> bytes:
+    """Train a compression dictionary for the codec from sample records.
+
+    Returns an empty dictionary when zstd cannot train on the samples
+    (too few or too small, e.g. a library of a handful of stories).
+    """
+    if codec == CODEC_ZSTD:
+        try:
+            return zstandard.train_dictionary(dict_size, samples).as_bytes()
+        except zstandard.ZstdError as e:
+            logging.warning(f"Could not train zstd dictionary on {len(samples)} samples, compressing without one: {str(e)}")
+            return b""
+    return _train_zlib_dictionary(samples, min(dict_size, _ZLIB_DICT_SIZE))
+
+
+class StoryArchive:
+    """Reader and appender for one archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with open(self._dat_path, "rb") as f:
+            magic, codec, dict_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{self._dat_path} is not a story archive")
+            self.codec = codec
+            self.dictionary = f.read(dict_len)
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("This archive uses zstd; install the zstandard package to read it")
+            zdict = zstandard.ZstdCompressionDict(self.dictionary)
+            self._compressor = zstandard.ZstdCompressor(level=19, dict_data=zdict)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+        self._dat_map: Optional[mmap.mmap] = None
+        self._idx_map: Optional[mmap.mmap] = None
+        self._mapped_count = 0
+
+    @property
+    def _dat_path(self) -> str:
+        return self.path + ".dat"
+
+    @property
+    def _idx_path(self) -> str:
+        return self.path + ".idx"
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        samples: list[bytes],
+        dict_size: int = 64 * 1024,
+        use_zstd: Optional[bool] = None
+    ) -> "StoryArchive":
+        """
+        Create an empty archive with a dictionary trained on sample records.
+
+        Args:
+            path: Archive path without extension
+            samples: Representative serialised records (a few hundred is plenty)
+            dict_size: Target dictionary size in bytes
+            use_zstd: Force the codec; defaults to zstd when it is installed
+        """
+        if use_zstd is None:
+            use_zstd = zstandard is not None
+        codec = CODEC_ZSTD if use_zstd else CODEC_ZLIB
+        dictionary = train_dictionary(samples, codec, dict_size) if samples else b""
+        with open(path + ".dat", "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, codec, len(dictionary)))
+            f.write(dictionary)
+        open(path + ".idx", "wb").close()
+        return cls(path)
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == CODEC_ZSTD:
+            return self._compressor.compress(data)
+        zdict = {"zdict": self.dictionary} if self.dictionary else {}
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15, **zdict)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, data: memoryview) -> bytes:
+        if self.codec == CODEC_ZSTD:
+            return self._decompressor.decompress(data)
+        zdict = {"zdict": self.dictionary} if self.dictionary else {}
+        decompressor = zlib.decompressobj(-15, **zdict)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def append(self, record: dict) -> int:
+        """Compress and append a record; returns its index."""
+        payload = self._compress(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            with open(self._dat_path, "ab") as dat:
+                offset = dat.seek(0, os.SEEK_END)
+                dat.write(payload)
+            # The index entry is written last, so readers never see a partial record
+            with open(self._idx_path, "ab") as idx:
+                idx.write(_ENTRY.pack(offset, len(payload)))
+                index = idx.tell() // _ENTRY.size - 1
+        return index
+
+    def _remap(self) -> None:
+        idx_size = os.path.getsize(self._idx_path)
+        count = idx_size // _ENTRY.size
+        if count == self._mapped_count and self._idx_map is not None:
+            return
+        for mapped in (self._dat_map, self._idx_map):
+            if mapped is not None:
+                mapped.close()
+        self._dat_map = self._idx_map = None
+        self._mapped_count = count
+        if count == 0:
+            return
+        with open(self._dat_path, "rb") as dat:
+            self._dat_map = mmap.mmap(dat.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self._idx_path, "rb") as idx:
+            self._idx_map = mmap.mmap(idx.fileno(), count * _ENTRY.size, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return os.path.getsize(self._idx_path) // _ENTRY.size
+
+    def get_bytes(self, index: int) -> bytes:
+        """Decompressed JSON bytes of record index."""
+        with self._lock:
+            if index >= self._mapped_count:
+                self._remap()
+            if not 0 <= index < self._mapped_count:
+                raise IndexError(f"Record {index} not in archive of {self._mapped_count} records")
+            offset, length = _ENTRY.unpack_from(self._idx_map, index * _ENTRY.size)
+            view = memoryview(self._dat_map)[offset:offset + length]
+            try:
+                return self._decompress(view)
+            finally:
+                view.release()
+
+    def get(self, index: int) -> dict:
+        """Record index as a dict."""
+        return json.loads(self.get_bytes(index))
+
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self)):
+            yield self.get(index)
+
+    def close(self) -> None:
+        with self._lock:
+            for mapped in (self._dat_map, self._idx_map):
+                if mapped is not None:
+                    mapped.close()
+            self._dat_map = self._idx_map = None
+            self._mapped_count = 0
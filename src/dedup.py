@@ -0,0 +1,171 @@
+"""Near-duplicate story detection with MinHash signatures and LSH banding.
+
+Signatures use one-permutation MinHash: each word 3-gram is hashed once and
+the minimum is kept per bin, with empty bins filled from their neighbour.
+That needs one hash per shingle instead of one per shingle per permutation,
+so a ~350-word story is signed and checked in well under a millisecond.
+"""
+import hashlib
+import itertools
+import string
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Hashable, Optional
+
+from pydantic import BaseModel, Field
+
+_PUNCTUATION = string.punctuation + "“”‘’।॥…—–"
+_MAX_HASH = (1 << 64) - 1
+
+
+class DedupConfig(BaseModel):
+    """Tuning knobs for near-duplicate detection."""
+    shingle_size: int = Field(default=3, description="Words per shingle")
+    num_bins: int = Field(default=64, description="Signature length")
+    bands: int = Field(default=16, description="LSH bands; num_bins must be divisible by this")
+    threshold: float = Field(default=0.5, description="Estimated Jaccard similarity that counts as a duplicate")
+    capacity_per_key: int = Field(default=200, description="Stories kept per key before the oldest is evicted")
+
+
+def shingles(text: str, size: int = 3) -> set[str]:
+    """Normalised word n-grams of the text."""
+    words = [w.strip(_PUNCTUATION) for w in text.lower().split()]
+    words = [w for w in words if w]
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _hash64(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class _KeyIndex:
+    """LSH buckets and signatures for one parameter key."""
+
+    def __init__(self, bands: int):
+        self.signatures: OrderedDict[int, tuple[int, ...]] = OrderedDict()
+        self.buckets: list[dict[tuple, set[int]]] = [defaultdict(set) for _ in range(bands)]
+
+
+class NearDuplicateIndex:
+    """Per-key MinHash/LSH index supporting incremental insert and eviction."""
+
+    def __init__(self, config: Optional[DedupConfig] = None):
+        self.config = config or DedupConfig()
+        if self.config.num_bins % self.config.bands:
+            raise ValueError("num_bins must be divisible by bands")
+        self._rows = self.config.num_bins // self.config.bands
+        self._lock = threading.Lock()
+        self._keys: dict[Hashable, _KeyIndex] = {}
+        self._ids = itertools.count(1)
+        self._duplicates_found = 0
+
+    def signature(self, text: str) -> tuple[int, ...]:
+        """One-permutation MinHash signature of the text."""
+        num_bins = self.config.num_bins
+        bins = [_MAX_HASH] * num_bins
+        for shingle in shingles(text, self.config.shingle_size):
+            h = _hash64(shingle)
+            b = h % num_bins
+            value = h // num_bins
+            if value < bins[b]:
+                bins[b] = value
+        # Densify: an empty bin borrows the value of the next non-empty bin
+        if all(v == _MAX_HASH for v in bins):
+            return tuple(bins)
+        for i in range(num_bins):
+            if bins[i] == _MAX_HASH:
+                j = (i + 1) % num_bins
+                while bins[j] == _MAX_HASH:
+                    j = (j + 1) % num_bins
+                bins[i] = bins[j] + (j - i) % num_bins * _MAX_HASH
+        return tuple(bins)
+
+    def _bands(self, signature: tuple[int, ...]):
+        rows = self._rows
+        for band in range(self.config.bands):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    @staticmethod
+    def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity of two signatures."""
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+    def find_duplicate(self, key: Hashable, text: str) -> Optional[tuple[int, float]]:
+        """Return (doc_id, similarity) of the closest near-duplicate under key, if any."""
+        return self._find(key, self.signature(text))
+
+    def _find(self, key: Hashable, signature: tuple[int, ...]) -> Optional[tuple[int, float]]:
+        with self._lock:
+            index = self._keys.get(key)
+            if index is None:
+                return None
+            candidates: set[int] = set()
+            for band, rows in self._bands(signature):
+                candidates |= index.buckets[band].get(rows, set())
+            best: Optional[tuple[int, float]] = None
+            for doc_id in candidates:
+                score = self.similarity(signature, index.signatures[doc_id])
+                if score >= self.config.threshold and (best is None or score > best[1]):
+                    best = (doc_id, score)
+            if best is not None:
+                self._duplicates_found += 1
+            return best
+
+    def is_duplicate(self, key: Hashable, text: str) -> bool:
+        return self.find_duplicate(key, text) is not None
+
+    def add(self, key: Hashable, text: str) -> int:
+        """Insert a story and return its doc id; evicts the key's oldest if full."""
+        return self._add(key, self.signature(text))
+
+    def _add(self, key: Hashable, signature: tuple[int, ...]) -> int:
+        with self._lock:
+            index = self._keys.setdefault(key, _KeyIndex(self.config.bands))
+            doc_id = next(self._ids)
+            index.signatures[doc_id] = signature
+            for band, rows in self._bands(signature):
+                index.buckets[band][rows].add(doc_id)
+            while len(index.signatures) > self.config.capacity_per_key:
+                oldest = next(iter(index.signatures))
+                self._remove_locked(index, oldest)
+            return doc_id
+
+    def add_if_new(self, key: Hashable, text: str) -> Optional[int]:
+        """Insert the story unless it is a near-duplicate; returns its doc id or None."""
+        signature = self.signature(text)
+        if self._find(key, signature) is not None:
+            return None
+        return self._add(key, signature)
+
+    def remove(self, key: Hashable, doc_id: int) -> None:
+        """Evict a story from the index."""
+        with self._lock:
+            index = self._keys.get(key)
+            if index is not None and doc_id in index.signatures:
+                self._remove_locked(index, doc_id)
+                if not index.signatures:
+                    del self._keys[key]
+
+    def _remove_locked(self, index: _KeyIndex, doc_id: int) -> None:
+        signature = index.signatures.pop(doc_id)
+        for band, rows in self._bands(signature):
+            bucket = index.buckets[band]
+            members = bucket.get(rows)
+            if members is not None:
+                members.discard(doc_id)
+                if not members:
+                    del bucket[rows]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "stories": sum(len(index.signatures) for index in self._keys.values()),
+                "duplicates_found": self._duplicates_found,
+            }
+
+
+# Stories already served to users, per parameter combination
+served_index = NearDuplicateIndex()
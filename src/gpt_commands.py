@@ -1,13 +1,27 @@
-import openai
 import logging
 import streamlit as st
 
 from src.agents.graph import generate_story_with_agents, generate_story_with_streaming
+from src.agents.state import StoryParameters
+from src.llm import GenerationCancelled, attempt_timeout, call_llm, get_breaker, get_cancellation_stats, get_router
+from src.llm.length_control import get_length_controller
+from src.dedup import served_index
+from src.library import get_story_library
+from src.prefetch_pool import PrefetchPool
+from src.profiling import profile_request
+from src.story_cache import params_key, story_cache
 
-# Configure OpenAI
-client = openai.OpenAI(
-    api_key=st.secrets["OPENAI_KEY"]
-)
+
+def get_openai_key():
+    """OpenAI key from Streamlit secrets; None when only keyless (e.g. local) endpoints are used."""
+    try:
+        return st.secrets["OPENAI_KEY"]
+    except (KeyError, FileNotFoundError):
+        return None
+
+
+# Timeout for the simple-mode fallback used while the provider circuit is open
+FALLBACK_TIMEOUT = 15.0
 
 
 def get_story_requirements(setting):
@@ -83,29 +97,159 @@ def get_system_prompt():
             - Example: "Ek choti si ladki Priya rehti thi. Uske paas ek cute sa puppy tha. Wo har roz uske saath park mein play karti thi."""
 
 
-def generate_story_simple(language, setting, moral, culture):
+def generate_story_simple(language, setting, moral, culture, timeout=None, cancel_token=None):
     """
     Generate a story using simple single-shot LLM call.
     
-    This is the original method, kept as fallback.
+    This is the original method, kept as fallback. When a timeout is given
+    the call is attempted even if the provider circuit is open. Cancelling
+    cancel_token aborts the request.
     """
     try:
-        response = client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "system", "content": get_system_prompt()},
-                {"role": "user", "content": get_story_prompt(language, setting, moral, culture)}
-            ],
-            temperature=0.7,
-            max_tokens=1000
+        messages = [
+            {"role": "system", "content": get_system_prompt()},
+            {"role": "user", "content": get_story_prompt(language, setting, moral, culture)}
+        ]
+        router = get_router()
+        length_controller = get_length_controller()
+        max_tokens = length_controller.max_tokens(language, "simple", "gpt-5-mini")
+        
+        endpoint_timeout = router.request_timeout(timeout or attempt_timeout())
+        
+        def send(attempt_token):
+            # Each attempt uses its own abortable client, so a hedge's loser can be cut off
+            http_client = attempt_token.http_client(timeout=endpoint_timeout)
+            
+            def send_to(endpoint):
+                llm_client = router.openai_client(
+                    endpoint, get_openai_key(), timeout=endpoint_timeout, http_client=http_client
+                )
+                return llm_client.chat.completions.create(
+                    model=endpoint.model or "gpt-5-mini",
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=max_tokens
+                )
+            
+            return router.run(send_to, label="simple", cancel_token=attempt_token)
+        
+        response = call_llm(
+            send,
+            label="simple",
+            timeout=timeout,
+            bypass_breaker=timeout is not None,
+            # max_tokens is left out: it follows the learned length stats,
+            # so it would stop recorded requests matching on replay
+            request={
+                "model": "gpt-5-mini",
+                "temperature": 0.7,
+                "messages": messages
+            },
+            cancel_token=cancel_token
         )
-        return response.choices[0].message.content
+        story = response.choices[0].message.content
+        if story and response.usage:
+            details = response.usage.completion_tokens_details
+            reasoning = (details.reasoning_tokens or 0) if details else 0
+            length_controller.observe(language, story, response.usage.completion_tokens - reasoning)
+        if story:
+            story_cache.put(params_key(language, setting, moral, culture), story)
+        return story
     except Exception as e:
         logging.error(f"Error generating story: {str(e)}")
         return None
 
 
-def generate_story(language, setting, moral, culture, use_agents=True):
+def generate_story_fallback(language, setting, moral, culture):
+    """
+    Cheapest viable story while the provider circuit is open.
+    
+    Serves a cached story if one exists, then a library story with the same
+    parameters, otherwise tries simple mode with a short timeout.
+    """
+    cached = story_cache.get(params_key(language, setting, moral, culture))
+    if cached:
+        logging.info("Provider circuit open, serving cached story")
+        return cached
+    try:
+        stored = get_story_library().pick(
+            StoryParameters(language=language, setting=setting, moral=moral, culture=culture)
+        )
+        if stored:
+            logging.info("Provider circuit open, serving library story")
+            return stored.story
+    except Exception as e:
+        logging.error(f"Error reading story library: {str(e)}")
+    logging.info("Provider circuit open, trying simple mode with short timeout")
+    return generate_story_simple(language, setting, moral, culture, timeout=FALLBACK_TIMEOUT)
+
+
+def _prefetch_story(key):
+    """Low-priority agent run used to top up the prefetch pool."""
+    language, setting, moral, culture = key
+    return generate_story_with_agents(
+        language=language,
+        setting=setting,
+        moral=moral,
+        culture=culture,
+        api_key=get_openai_key()
+    )
+
+
+# Ready-to-serve stories for popular parameter combinations
+prefetch_pool = PrefetchPool(
+    story_cache,
+    generate=_prefetch_story,
+    is_healthy=lambda: get_breaker().state == "closed",
+    served_index=served_index
+).start()
+
+
+def _take_pooled(key):
+    """Pop a pooled story that is not a near-duplicate of one already served."""
+    while True:
+        story = prefetch_pool.take(key)
+        if story is None or not served_index.is_duplicate(key, story):
+            return story
+
+
+def _mark_served(key, story, plan=None):
+    """Remember a story as served, flagging near-duplicates, and add it to the library."""
+    if not story:
+        return
+    duplicate = served_index.find_duplicate(key, story)
+    if duplicate:
+        logging.info(f"Serving near-duplicate story (similarity {duplicate[1]:.2f})")
+    served_index.add(key, story)
+    try:
+        language, setting, moral, culture = key
+        get_story_library().save(
+            story,
+            StoryParameters(language=language, setting=setting, moral=moral, culture=culture),
+            plan=plan
+        )
+    except Exception as e:
+        logging.error(f"Error saving story to library: {str(e)}")
+
+
+def mark_served(parameters, story, plan=None):
+    """Mark a story generated without being shown (a session prefetch) as served once it is shown."""
+    _mark_served(
+        params_key(parameters.language, parameters.setting, parameters.moral, parameters.culture),
+        story,
+        plan=plan
+    )
+
+
+def _keep_unserved(key, story):
+    """Stock a story whose requester has left, so the next request gets it."""
+    get_cancellation_stats().record_finished_detached()
+    if not prefetch_pool.add(key, story):
+        story_cache.put(key, story)
+
+
+def generate_story(language, setting, moral, culture, use_agents=True, cancel_token=None, prefetch=False,
+                   profile=None):
     """
     Generate a bedtime story based on given parameters.
     
@@ -115,44 +259,153 @@ def generate_story(language, setting, moral, culture, use_agents=True):
         moral (str): The moral lesson to convey
         culture (str): The cultural context for the story
         use_agents (bool): Whether to use the LangGraph agent pipeline
+        cancel_token (CancelToken): Aborts generation and its in-flight
+            requests when cancelled; a detached token's story is kept unserved
+        prefetch (bool): Speculative request nobody asked for yet; it does not
+            count towards popularity, take stories from the prefetch pool or
+            get marked served (see mark_served)
+        profile (bool): Profile this request; None defers to STORY_PROFILE
     
     Returns:
         str: Generated story text or None if generation fails
     """
+    key = params_key(language, setting, moral, culture)
+    if not prefetch:
+        story_cache.record_request(key)
+    with profile_request("generate_story", enabled=profile):
+        story = _generate_story(language, setting, moral, culture, use_agents, cancel_token, prefetch)
+        if story and cancel_token is not None and cancel_token.detached:
+            _keep_unserved(key, story)
+        elif not prefetch:
+            # A prefetched story is marked served when its session shows it
+            _mark_served(key, story)
+    return story
+
+
+def _generate_story(language, setting, moral, culture, use_agents, cancel_token=None, prefetch=False):
+    key = params_key(language, setting, moral, culture)
+    if use_agents and not prefetch:
+        pooled = _take_pooled(key)
+        if pooled:
+            story_cache.put(key, pooled)
+            return pooled
+    if get_breaker().is_open():
+        return generate_story_fallback(language, setting, moral, culture)
+    
     if use_agents:
         try:
-            api_key = st.secrets["OPENAI_KEY"]
+            api_key = get_openai_key()
             story = generate_story_with_agents(
                 language=language,
                 setting=setting,
                 moral=moral,
                 culture=culture,
-                api_key=api_key
+                api_key=api_key,
+                cancel_token=cancel_token
             )
             if story:
+                story_cache.put(params_key(language, setting, moral, culture), story)
                 return story
             # Fall back to simple mode if agents fail
             logging.warning("Agent generation failed, falling back to simple mode")
-            return generate_story_simple(language, setting, moral, culture)
         except Exception as e:
             logging.error(f"Error in agent generation: {str(e)}")
-            return generate_story_simple(language, setting, moral, culture)
-    else:
-        return generate_story_simple(language, setting, moral, culture)
+        if get_breaker().is_open():
+            return generate_story_fallback(language, setting, moral, culture)
+    return generate_story_simple(language, setting, moral, culture, cancel_token=cancel_token)
 
 
-def generate_story_stream(language, setting, moral, culture):
+def generate_story_stream(language, setting, moral, culture, cancel_token=None, prefetch=False, profile=None):
     """
     Generate a story with streaming for progress display.
     
-    Yields (stage, data) tuples for UI updates.
+    Yields (stage, data) tuples for UI updates. A story served from the
+    prefetch pool is yielded as a single ("pool", data) tuple, and while the
+    provider circuit is open as a single ("fallback", data) tuple. If the
+    pipeline fails, a simple-mode story follows as a ("fallback", data)
+    tuple, or ("error", data) if that fails too.
+    
+    Cancelling cancel_token raises GenerationCancelled and aborts in-flight
+    requests; if the token is detached instead, the pipeline finishes and
+    its story is stocked in the prefetch pool rather than marked served.
+    
+    A prefetch (a session's speculative next story) does not count towards
+    popularity, never takes stories from the prefetch pool and is not marked
+    served; call mark_served when it is shown.
+    
+    profile turns profiling on or off for this request; None defers to
+    STORY_PROFILE.
     """
-    api_key = st.secrets["OPENAI_KEY"]
-    yield from generate_story_with_streaming(
+    with profile_request("generate_story_stream", enabled=profile):
+        yield from _generate_story_stream(language, setting, moral, culture, cancel_token, prefetch)
+
+
+def _generate_story_stream(language, setting, moral, culture, cancel_token, prefetch=False):
+    key = params_key(language, setting, moral, culture)
+    if not prefetch:
+        story_cache.record_request(key)
+    pooled = None if prefetch else _take_pooled(key)
+    if pooled:
+        story_cache.put(key, pooled)
+        _mark_served(key, pooled)
+        yield ("pool", {"final_story": pooled, "current_stage": "complete"})
+        return
+    if get_breaker().is_open():
+        story = generate_story_fallback(language, setting, moral, culture)
+        if story:
+            _mark_served(key, story)
+            yield ("fallback", {"final_story": story, "current_stage": "complete"})
+        else:
+            yield ("error", {"error": "Story service is temporarily unavailable"})
+        return
+    
+    api_key = get_openai_key()
+    plan = None
+    story = None
+    for stage, state in generate_story_with_streaming(
         language=language,
         setting=setting,
         moral=moral,
         culture=culture,
-        api_key=api_key
-    )
+        api_key=api_key,
+        cancel_token=cancel_token
+    ):
+        if stage == "error":
+            logging.error(f"Error in agent generation: {state.get('error')}")
+            break
+        if state.get("plan"):
+            plan = state["plan"]
+        if stage == "enhancer" and state.get("final_story"):
+            story = state["final_story"]
+            _finish_streamed(key, story, cancel_token, prefetch, plan=plan)
+        yield (stage, state)
+    if story:
+        return
+    
+    # Fall back to simple mode if agents fail
+    logging.warning("Agent generation failed, falling back to simple mode")
+    if get_breaker().is_open():
+        story = generate_story_fallback(language, setting, moral, culture)
+    else:
+        try:
+            story = generate_story_simple(language, setting, moral, culture, cancel_token=cancel_token)
+        except GenerationCancelled:
+            expected = get_length_controller().expected_tokens(language, "simple")
+            get_cancellation_stats().record_cancelled("simple", expected)
+            raise
+    if story:
+        _finish_streamed(key, story, cancel_token, prefetch)
+        yield ("fallback", {"final_story": story, "current_stage": "complete"})
+    else:
+        yield ("error", {"error": "Story generation failed"})
+
 
+def _finish_streamed(key, story, cancel_token, prefetch, plan=None):
+    """Cache (or stock, if detached) a streamed story and mark it served."""
+    if cancel_token is not None and cancel_token.detached:
+        _keep_unserved(key, story)
+    else:
+        story_cache.put(key, story)
+        if not prefetch:
+            # A prefetched story is marked served when its session shows it
+            _mark_served(key, story, plan=plan)
@@ -0,0 +1,570 @@
+"""Background story jobs: a SQLite-backed queue and a bounded worker pool.
+
+The queue lives in a SQLite file so several Streamlit worker processes can
+share it. Any process's pool may pick up a queued job, progress events are
+appended to the same file, and the UI polls them by job id.
+
+Watching sessions touch their job, and their prefetched next job, while
+the page is open. Jobs that are cancelled, or whose session stopped
+watching, are aborted by the pool that runs them, including the LLM
+request in flight (see src/llm/cancellation.py).
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from src.agents.graph import PIPELINE_STAGES
+from src.agents.state import StoryParameters, StoryPlan
+from src.llm import CancelToken, GenerationCancelled, get_cancellation_stats
+from src.llm.length_control import get_length_controller
+from src.storage import data_path
+
+JobStatus = Literal["queued", "running", "done", "failed", "cancelled"]
+
+# Running jobs whose worker has been silent this long are requeued
+JOB_LEASE_SECONDS = 300.0
+
+# Watched jobs nobody has polled for this long are cancelled; long enough
+# to outlast a page reload, which resumes the job from the URL
+JOB_ABANDON_SECONDS = 60.0
+
+# Finished jobs and their events are deleted after this long (STORY_JOB_RETENTION_DAYS)
+JOB_RETENTION_SECONDS = 7 * 24 * 3600.0
+
+# How often each pool's monitor purges expired jobs
+JOB_PURGE_INTERVAL = 600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    parameters TEXT NOT NULL,
+    use_agents INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    story TEXT,
+    plan TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    watched_at REAL,
+    prefetch INTEGER NOT NULL DEFAULT 0,
+    attempt INTEGER NOT NULL DEFAULT 0,
+    profile INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id);
+"""
+
+
+class Job(BaseModel):
+    """A queued or finished story generation."""
+    id: str = Field(description="Job id returned by submit")
+    parameters: StoryParameters = Field(description="Story parameters")
+    use_agents: bool = Field(description="Whether the agent pipeline is used")
+    prefetch: bool = Field(default=False, description="Speculative job nobody is waiting for yet")
+    profile: Optional[bool] = Field(default=None, description="Profile the generation; None defers to STORY_PROFILE")
+    status: JobStatus = Field(description="Current job status")
+    story: Optional[str] = Field(default=None, description="Final story once done")
+    plan: Optional[StoryPlan] = Field(default=None, description="Planner output, if any")
+    error: Optional[str] = Field(default=None, description="Error message if failed")
+    created_at: float = Field(description="Unix time the job was submitted")
+    updated_at: float = Field(description="Unix time of the last status change or event")
+    attempt: int = Field(default=0, description="Incremented each time a worker claims the job")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+
+class JobEvent(BaseModel):
+    """A progress event emitted by a running job."""
+    id: int = Field(description="Monotonic event id, usable as a poll cursor")
+    job_id: str = Field(description="Job the event belongs to")
+    stage: str = Field(description="Pipeline stage (planner, writer, ...)")
+    payload: dict = Field(description="JSON-serialisable stage output")
+    created_at: float = Field(description="Unix time the event was recorded")
+
+
+def _to_jsonable(node_state: dict) -> dict:
+    """Convert a graph node's state update into plain JSON data."""
+    payload = {}
+    for key, value in node_state.items():
+        if isinstance(value, BaseModel):
+            value = value.model_dump()
+        payload[key] = value
+    return payload
+
+
+class JobQueue:
+    """Job storage shared between processes through a SQLite file."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = str(db_path or data_path("jobs.sqlite3"))
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "watched_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN watched_at REAL")
+            if "prefetch" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN prefetch INTEGER NOT NULL DEFAULT 0")
+            if "attempt" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempt INTEGER NOT NULL DEFAULT 0")
+            if "profile" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN profile INTEGER")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            parameters=StoryParameters(**json.loads(row["parameters"])),
+            use_agents=bool(row["use_agents"]),
+            prefetch=bool(row["prefetch"]),
+            profile=None if row["profile"] is None else bool(row["profile"]),
+            status=row["status"],
+            story=row["story"],
+            plan=StoryPlan(**json.loads(row["plan"])) if row["plan"] else None,
+            error=row["error"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            attempt=row["attempt"],
+        )
+
+    def submit(
+        self,
+        parameters: StoryParameters,
+        use_agents: bool = True,
+        prefetch: bool = False,
+        profile: Optional[bool] = None
+    ) -> str:
+        """Queue a story generation and return its job id.
+
+        Prefetch jobs are claimed only after every queued interactive job.
+        They count as watched from the start, so they are cancelled once
+        their session stops touching them.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, parameters, use_agents, prefetch, profile, status, "
+                "created_at, updated_at, watched_at) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, parameters.model_dump_json(), int(use_agents), int(prefetch),
+                 None if profile is None else int(profile), now, now, now if prefetch else None)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return the job, or None if the id is unknown."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def claim_next(self, owner: str, include_prefetch: bool = True) -> Optional[Job]:
+        """Atomically move the oldest queued job to running and return it.
+
+        Interactive jobs go first; prefetch jobs are only considered when
+        include_prefetch is True and no interactive job is queued.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', owner = NULL "
+                    "WHERE status = 'running' AND updated_at < ?",
+                    (now - JOB_LEASE_SECONDS,)
+                )
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND (prefetch = 0 OR ?) "
+                    "ORDER BY prefetch, created_at LIMIT 1",
+                    (int(include_prefetch),)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, attempt = attempt + 1, updated_at = ? "
+                    "WHERE id = ?",
+                    (owner, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        job = self._row_to_job(row)
+        return job.model_copy(update={"status": "running", "updated_at": now, "attempt": job.attempt + 1})
+
+    def add_event(self, job_id: str, stage: str, payload: dict) -> None:
+        """Append a progress event and refresh the job's lease."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, stage, payload, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, stage, json.dumps(payload, default=str), now)
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def events(self, job_id: str, after_id: int = 0) -> list[JobEvent]:
+        """Return the job's events with id greater than after_id."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, after_id)
+            ).fetchall()
+        return [
+            JobEvent(
+                id=row["id"],
+                job_id=row["job_id"],
+                stage=row["stage"],
+                payload=json.loads(row["payload"]),
+                created_at=row["created_at"],
+            )
+            for row in rows
+        ]
+
+    def complete(self, job_id: str, attempt: int, story: str, plan: Optional[StoryPlan]) -> bool:
+        """Mark a running job as done with its story.
+
+        attempt is the value claim_next returned; a worker whose job was
+        requeued and claimed again in the meantime no longer owns it.
+        Returns False if the update did not apply.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', story = ?, plan = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND attempt = ?",
+                (story, plan.model_dump_json() if plan else None, time.time(), job_id, attempt)
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, attempt: int, error: str) -> bool:
+        """Mark a running job as failed; see complete for attempt."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND attempt = ?",
+                (error, time.time(), job_id, attempt)
+            )
+        return cursor.rowcount > 0
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if already finished."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id)
+            )
+        return cursor.rowcount > 0
+
+    def touch(self, job_id: str) -> None:
+        """Record that a session is still watching the job."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET watched_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def cancel_abandoned(self, max_idle: float = JOB_ABANDON_SECONDS) -> list[Job]:
+        """Cancel unfinished jobs whose watcher has been gone for max_idle seconds.
+
+        Jobs that were never watched (e.g. submitted by scripts) are left alone.
+        Returns the cancelled jobs as they were before cancelling.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT * FROM jobs WHERE status IN ('queued', 'running') "
+                    "AND watched_at IS NOT NULL AND watched_at < ?",
+                    (now - max_idle,)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ?",
+                    [(now, row["id"]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [self._row_to_job(row) for row in rows]
+
+    def purge_finished(self, max_age: float = JOB_RETENTION_SECONDS) -> int:
+        """Delete finished jobs last updated more than max_age seconds ago, with their events.
+
+        Returns the number of jobs deleted.
+        """
+        finished = "status IN ('done', 'failed', 'cancelled') AND updated_at < ?"
+        cutoff = time.time() - max_age
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE {finished})",
+                    (cutoff,)
+                )
+                cursor = conn.execute(f"DELETE FROM jobs WHERE {finished}", (cutoff,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount
+
+    def statuses(self, job_ids: list[str]) -> dict[str, JobStatus]:
+        """Return the current status of each known job id."""
+        if not job_ids:
+            return {}
+        placeholders = ",".join("?" * len(job_ids))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, status FROM jobs WHERE id IN ({placeholders})", job_ids
+            ).fetchall()
+        return {row["id"]: row["status"] for row in rows}
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of jobs per status."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+def _record_queued_cancel(job: Job) -> None:
+    """Count a job cancelled before it started, with all the output it would have produced."""
+    controller = get_length_controller()
+    language = job.parameters.language
+    stages = PIPELINE_STAGES if job.use_agents else ("simple",)
+    tokens = sum(controller.expected_tokens(language, stage) for stage in stages)
+    get_cancellation_stats().record_cancelled("queued", tokens)
+
+
+class JobWorkerPool:
+    """A fixed number of worker threads executing queued jobs.
+
+    Workers are woken immediately for jobs submitted in this process and poll
+    the queue otherwise, so jobs submitted by other processes are picked up too.
+    At most max_prefetch_workers of them run prefetch jobs at a time, so
+    speculative work cannot take the workers interactive jobs need.
+    A monitor thread cancels abandoned jobs and aborts running jobs that were
+    cancelled, or with finish_cancelled lets them finish and keeps their story
+    for the next request instead. It also purges finished jobs older than
+    retention_seconds.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        max_workers: int = 4,
+        poll_interval: float = 0.5,
+        finish_cancelled: bool = False,
+        max_prefetch_workers: int = 1,
+        retention_seconds: float = JOB_RETENTION_SECONDS
+    ):
+        self.queue = queue
+        self.max_workers = max_workers
+        self.max_prefetch_workers = max_prefetch_workers
+        self.poll_interval = poll_interval
+        self.finish_cancelled = finish_cancelled
+        self.retention_seconds = retention_seconds
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tokens: dict[str, CancelToken] = {}
+        self._tokens_lock = threading.Lock()
+        self._prefetch_running = 0
+        self._prefetch_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True, name=f"story-worker-{i}")
+            for i in range(max_workers)
+        ]
+        self._threads.append(threading.Thread(target=self._monitor, daemon=True, name="story-job-monitor"))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self,
+        parameters: StoryParameters,
+        use_agents: bool = True,
+        prefetch: bool = False,
+        profile: Optional[bool] = None
+    ) -> str:
+        """Queue a job and wake a worker; returns the job id."""
+        job_id = self.queue.submit(parameters, use_agents, prefetch=prefetch, profile=profile)
+        self._wakeup.set()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; a running one is aborted (or finished, see finish_cancelled)."""
+        job = self.queue.get(job_id)
+        if job is None or not self.queue.cancel(job_id):
+            return False
+        if job.status == "queued":
+            _record_queued_cancel(job)
+        self._signal(job_id)
+        return True
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _signal(self, job_id: str) -> None:
+        with self._tokens_lock:
+            token = self._tokens.get(job_id)
+        if token is None:
+            return
+        if self.finish_cancelled:
+            token.detach()
+        else:
+            token.cancel("cancelled by its session")
+
+    def _monitor(self) -> None:
+        last_purge = 0.0
+        while not self._stopped.wait(self.poll_interval):
+            if time.monotonic() - last_purge >= JOB_PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                try:
+                    purged = self.queue.purge_finished(self.retention_seconds)
+                    if purged:
+                        logging.info(f"Purged {purged} finished jobs")
+                except Exception as e:
+                    logging.error(f"Error purging finished jobs: {str(e)}")
+            try:
+                for job in self.queue.cancel_abandoned(JOB_ABANDON_SECONDS):
+                    logging.info(f"Cancelling abandoned job {job.id}")
+                    if job.status == "queued":
+                        _record_queued_cancel(job)
+                with self._tokens_lock:
+                    job_ids = [job_id for job_id, token in self._tokens.items() if not token.detached]
+                for job_id, status in self.queue.statuses(job_ids).items():
+                    if status == "cancelled":
+                        self._signal(job_id)
+            except Exception as e:
+                logging.error(f"Error checking for cancelled jobs: {str(e)}")
+
+    def _claim(self) -> Optional[Job]:
+        # Reserve a prefetch slot up front so two workers cannot both take the last one
+        with self._prefetch_lock:
+            include_prefetch = self._prefetch_running < self.max_prefetch_workers
+            if include_prefetch:
+                self._prefetch_running += 1
+        job = None
+        try:
+            job = self.queue.claim_next(self._owner, include_prefetch=include_prefetch)
+        finally:
+            if include_prefetch and (job is None or not job.prefetch):
+                with self._prefetch_lock:
+                    self._prefetch_running -= 1
+        return job
+
+    def _work(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"Error claiming job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._execute(job)
+            except Exception as e:
+                # e.g. the database was locked while recording the failure;
+                # the job's lease expires and it is requeued
+                logging.error(f"Error finishing job {job.id}: {str(e)}")
+            finally:
+                if job.prefetch:
+                    with self._prefetch_lock:
+                        self._prefetch_running -= 1
+
+    def _execute(self, job: Job) -> None:
+        # Imported here: gpt_commands starts the prefetch pool at import time
+        from src.gpt_commands import generate_story, generate_story_stream
+
+        params = job.parameters
+        token = CancelToken()
+        with self._tokens_lock:
+            self._tokens[job.id] = token
+        try:
+            story, plan = None, None
+            if job.use_agents:
+                for stage, state in generate_story_stream(
+                    params.language, params.setting, params.moral, params.culture,
+                    cancel_token=token, prefetch=job.prefetch, profile=job.profile
+                ):
+                    self.queue.add_event(job.id, stage, _to_jsonable(state))
+                    if state.get("plan"):
+                        plan = state["plan"]
+                    if state.get("final_story"):
+                        story = state["final_story"]
+            else:
+                self.queue.add_event(job.id, "writer", {})
+                try:
+                    story = generate_story(
+                        params.language, params.setting, params.moral, params.culture,
+                        use_agents=False, cancel_token=token, prefetch=job.prefetch,
+                        profile=job.profile
+                    )
+                except GenerationCancelled:
+                    expected = get_length_controller().expected_tokens(params.language, "simple")
+                    get_cancellation_stats().record_cancelled("simple", expected)
+                    raise
+            if story:
+                self.queue.complete(job.id, job.attempt, story, plan)
+            else:
+                self.queue.fail(job.id, job.attempt, "Story generation failed")
+        except GenerationCancelled:
+            logging.info(f"Job {job.id} cancelled")
+        except Exception as e:
+            logging.error(f"Error in job {job.id}: {str(e)}")
+            self.queue.fail(job.id, job.attempt, str(e))
+        finally:
+            with self._tokens_lock:
+                del self._tokens[job.id]
+            token.close()
+
+
+_pool: Optional[JobWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> JobWorkerPool:
+    """Return the process-wide worker pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = int(os.environ.get("STORY_JOB_WORKERS", "4"))
+            max_prefetch_workers = int(os.environ.get("STORY_PREFETCH_WORKERS", "1"))
+            finish_cancelled = os.environ.get("STORY_FINISH_CANCELLED", "").lower() in ("1", "true", "yes")
+            retention_days = float(os.environ.get("STORY_JOB_RETENTION_DAYS", "7"))
+            _pool = JobWorkerPool(
+                JobQueue(),
+                max_workers=max_workers,
+                finish_cancelled=finish_cancelled,
+                max_prefetch_workers=max_prefetch_workers,
+                retention_seconds=retention_days * 24 * 3600
+            )
+        return _pool
@@ -0,0 +1,254 @@
+"""Persistent, searchable library of every generated story.
+
+Stories are stored in SQLite with an FTS5 inverted index over title,
+characters, body and moral, so free-text queries such as "a puppy and
+sharing" combined with language/moral/culture filters stay in the
+millisecond range even with hundreds of thousands of stories.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from pydantic import BaseModel, Field
+
+from src.agents.state import StoryParameters, StoryPlan
+from src.storage import data_path
+
+# Devanagari vowel signs are combining marks, which unicode61 would treat as
+# separators and split Hindi words apart; declare the whole block as token chars
+_DEVANAGARI = "".join(chr(c) for c in range(0x0900, 0x0980) if chr(c) not in "।॥")
+_TOKENIZER = f"porter unicode61 tokenchars '{_DEVANAGARI}'"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY,
+    body_hash TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    characters TEXT NOT NULL,
+    body TEXT NOT NULL,
+    language TEXT NOT NULL,
+    setting TEXT NOT NULL,
+    moral TEXT NOT NULL,
+    culture TEXT NOT NULL,
+    plan TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stories_params ON stories (language, moral, culture, setting);
+CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+    title, characters, body, moral,
+    content='stories', content_rowid='id',
+    tokenize="{_TOKENIZER}"
+);
+CREATE TRIGGER IF NOT EXISTS stories_ai AFTER INSERT ON stories BEGIN
+    INSERT INTO stories_fts (rowid, title, characters, body, moral)
+    VALUES (new.id, new.title, new.characters, new.body, new.moral);
+END;
+CREATE TRIGGER IF NOT EXISTS stories_ad AFTER DELETE ON stories BEGIN
+    INSERT INTO stories_fts (stories_fts, rowid, title, characters, body, moral)
+    VALUES ('delete', old.id, old.title, old.characters, old.body, old.moral);
+END;
+"""
+
+# Words that carry no meaning in a library query ("find a story about ...")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "with", "about",
+    "for", "find", "show", "me", "story", "stories", "tale", "some", "any",
+}
+_WORD = re.compile(r"[\wऀ-ॿ]+")
+
+# Relative weight of title, characters, body and moral matches in ranking
+_BM25_WEIGHTS = (5.0, 3.0, 1.0, 2.0)
+
+
+class LibraryStory(BaseModel):
+    """A story stored in the library."""
+    id: int = Field(description="Library row id")
+    title: str = Field(description="Story title")
+    story: str = Field(description="Final story text")
+    parameters: StoryParameters = Field(description="Parameters the story was generated with")
+    plan: Optional[StoryPlan] = Field(default=None, description="Planner output, if available")
+    created_at: float = Field(description="Unix time the story was added")
+
+
+def _title_from_story(story: str) -> str:
+    first_line = story.strip().splitlines()[0] if story.strip() else "Untitled story"
+    return first_line.strip("# *")[:80]
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 query of quoted terms, or None if nothing is left."""
+    terms = [t for t in _WORD.findall(text.lower()) if t not in _STOPWORDS]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"' for t in dict.fromkeys(terms))
+
+
+class StoryLibrary:
+    """SQLite story store with a full-text index."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = str(db_path or data_path("library.sqlite3"))
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One connection per thread; searches are frequent and connecting is not free
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        yield conn
+
+    def save(
+        self,
+        story: str,
+        parameters: StoryParameters,
+        plan: Optional[StoryPlan] = None
+    ) -> Optional[int]:
+        """Add a story; returns its id, or None if the exact text is already stored."""
+        body_hash = hashlib.sha256(story.encode("utf-8")).hexdigest()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO stories "
+                "(body_hash, title, characters, body, language, setting, moral, culture, plan, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    body_hash,
+                    plan.title if plan else _title_from_story(story),
+                    "\n".join(plan.main_characters) if plan else "",
+                    story,
+                    parameters.language,
+                    parameters.setting,
+                    parameters.moral,
+                    parameters.culture,
+                    plan.model_dump_json() if plan else None,
+                    time.time(),
+                )
+            )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    @staticmethod
+    def _filters(
+        language: Optional[str],
+        setting: Optional[str],
+        moral: Optional[str],
+        culture: Optional[str]
+    ) -> tuple[str, list]:
+        clauses, args = [], []
+        for column, value in (("language", language), ("setting", setting), ("moral", moral), ("culture", culture)):
+            if value:
+                clauses.append(f"s.{column} = ?")
+                args.append(value)
+        return "".join(f" AND {c}" for c in clauses), args
+
+    def search(
+        self,
+        query: str = "",
+        language: Optional[str] = None,
+        setting: Optional[str] = None,
+        moral: Optional[str] = None,
+        culture: Optional[str] = None,
+        limit: int = 20
+    ) -> list[LibraryStory]:
+        """
+        Full-text search with optional exact filters, best matches first.
+
+        All query terms must match; if that finds nothing, stories matching
+        any term are returned instead. An empty query returns the newest
+        stories matching the filters.
+        """
+        where, args = self._filters(language, setting, moral, culture)
+        match = build_match_query(query)
+        with self._connect() as conn:
+            if match is None:
+                rows = conn.execute(
+                    f"SELECT s.* FROM stories s WHERE 1 = 1{where} ORDER BY s.id DESC LIMIT ?",
+                    (*args, limit)
+                ).fetchall()
+                return [self._row_to_story(row) for row in rows]
+
+            sql = (
+                "SELECT s.* FROM stories_fts f JOIN stories s ON s.id = f.rowid "
+                f"WHERE stories_fts MATCH ?{where} "
+                f"ORDER BY bm25(stories_fts, {', '.join(map(str, _BM25_WEIGHTS))}) LIMIT ?"
+            )
+            rows = conn.execute(sql, (match, *args, limit)).fetchall()
+            if not rows and " " in match:
+                rows = conn.execute(sql, (match.replace(" ", " OR "), *args, limit)).fetchall()
+        return [self._row_to_story(row) for row in rows]
+
+    def pick(self, parameters: StoryParameters, exclude_ids: tuple[int, ...] = ()) -> Optional[LibraryStory]:
+        """A random stored story with exactly these parameters, to serve instead of generating."""
+        placeholders = ",".join("?" * len(exclude_ids))
+        exclude = f" AND id NOT IN ({placeholders})" if exclude_ids else ""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM stories WHERE language = ? AND setting = ? AND moral = ? AND culture = ?"
+                f"{exclude} ORDER BY RANDOM() LIMIT 1",
+                (parameters.language, parameters.setting, parameters.moral, parameters.culture, *exclude_ids)
+            ).fetchone()
+        return self._row_to_story(row) if row else None
+
+    def export_archive(self, path: str, sample_size: int = 500):
+        """
+        Write every stored story to a compressed StoryArchive at path.
+
+        The compression dictionary is trained on a random sample of stories.
+        Returns the opened archive; record i is the i-th story by id.
+        """
+        from src.archive import StoryArchive
+
+        with self._connect() as conn:
+            sample_rows = conn.execute(
+                "SELECT * FROM stories ORDER BY RANDOM() LIMIT ?", (sample_size,)
+            ).fetchall()
+        samples = [
+            self._row_to_story(row).model_dump_json().encode("utf-8") for row in sample_rows
+        ]
+        archive = StoryArchive.create(path, samples)
+        with self._connect() as conn:
+            for row in conn.execute("SELECT * FROM stories ORDER BY id"):
+                archive.append(self._row_to_story(row).model_dump(mode="json"))
+        return archive
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+    @staticmethod
+    def _row_to_story(row: sqlite3.Row) -> LibraryStory:
+        return LibraryStory(
+            id=row["id"],
+            title=row["title"],
+            story=row["body"],
+            parameters=StoryParameters(
+                language=row["language"],
+                setting=row["setting"],
+                moral=row["moral"],
+                culture=row["culture"],
+            ),
+            plan=StoryPlan(**json.loads(row["plan"])) if row["plan"] else None,
+            created_at=row["created_at"],
+        )
+
+
+_library: Optional[StoryLibrary] = None
+_library_lock = threading.Lock()
+
+
+def get_story_library() -> StoryLibrary:
+    """Return the process-wide story library."""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = StoryLibrary()
+        return _library
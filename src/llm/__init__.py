@@ -0,0 +1,18 @@
+# LLM call layer shared by the agent pipeline and simple mode
+from .calls import attempt_timeout, call_llm, get_breaker, get_cassette, get_hedger
+from .cancellation import CancelToken, GenerationCancelled, get_cancellation_stats
+from .cassette import Cassette, CassetteMissError
+from .circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitOpenError
+from .hedging import HedgedExecutor, HedgingConfig
+from .providers import (
+    SERVED_MODEL, ProviderEndpoint, ProviderRouter, RoutedChatModel, RoutingConfig, get_router, set_router
+)
+
+__all__ = [
+    "attempt_timeout", "call_llm", "get_breaker", "get_cassette", "get_hedger",
+    "CancelToken", "GenerationCancelled", "get_cancellation_stats",
+    "Cassette", "CassetteMissError",
+    "CircuitBreaker", "CircuitBreakerConfig", "CircuitOpenError",
+    "HedgedExecutor", "HedgingConfig",
+    "SERVED_MODEL", "ProviderEndpoint", "ProviderRouter", "RoutedChatModel", "RoutingConfig", "get_router", "set_router",
+]
@@ -0,0 +1,91 @@
+"""Shared entry point for every provider call made by the app."""
+import time
+from typing import Callable, Optional, TypeVar
+
+from .cancellation import CancelToken
+from .cassette import Cassette, cassette_from_env
+from .circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitOpenError
+from .hedging import HedgedExecutor, HedgingConfig
+
+T = TypeVar("T")
+
+_hedger = HedgedExecutor(HedgingConfig())
+_breaker = CircuitBreaker(CircuitBreakerConfig())
+_cassette = cassette_from_env()
+
+
+def get_hedger() -> HedgedExecutor:
+    """Return the process-wide hedged executor."""
+    return _hedger
+
+
+def get_breaker() -> CircuitBreaker:
+    """Return the process-wide provider circuit breaker."""
+    return _breaker
+
+
+def get_cassette() -> Cassette:
+    """Return the process-wide record/replay cassette."""
+    return _cassette
+
+
+def attempt_timeout() -> float:
+    """Per-attempt timeout in seconds to configure on provider clients."""
+    return _hedger.config.attempt_timeout
+
+
+def call_llm(
+    send: Callable[[CancelToken], T],
+    label: str = "default",
+    timeout: Optional[float] = None,
+    bypass_breaker: bool = False,
+    request: Optional[dict] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> T:
+    """
+    Run a provider call through the shared call layer.
+
+    Args:
+        send: Performs one provider request; it gets the attempt's CancelToken
+            and should send through that token's http_client, so an attempt
+            that is no longer needed (e.g. a hedge's loser) can be aborted
+        label: Call kind used for per-kind latency tracking (e.g. "writer")
+        timeout: Overall timeout in seconds, defaults to the attempt timeout
+        bypass_breaker: Send even if the circuit breaker is open (used for
+            short-timeout fallbacks); only admitted calls update the breaker
+        request: Description of the request (model, messages, sampling
+            params) used to fingerprint it for cassette record/replay
+        cancel_token: Token of the generation the call belongs to; cancelling
+            it abandons the call right away
+
+    Returns:
+        The provider response from the first successful attempt
+
+    Raises:
+        CircuitOpenError: If the breaker is open and bypass_breaker is False
+        GenerationCancelled: If cancel_token is cancelled before or during the call
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    admitted = _breaker.allow_request()
+    if not admitted and not bypass_breaker:
+        raise CircuitOpenError(f"Provider circuit is open, skipping '{label}' call")
+
+    if request is not None:
+        send = _cassette.wrap(send, request, label)
+
+    started = time.monotonic()
+    try:
+        result = _hedger.run(send, label=label, timeout=timeout, cancel_token=cancel_token)
+    except Exception:
+        if admitted:
+            _breaker.record(False, time.monotonic() - started)
+        raise
+    except BaseException:
+        # Cancelled (or interrupted) calls say nothing about provider health
+        if admitted:
+            _breaker.release()
+        raise
+    if admitted:
+        _breaker.record(True, time.monotonic() - started)
+    return result
@@ -0,0 +1,266 @@
+"""Cooperative cancellation of LLM work nobody is waiting for anymore.
+
+A CancelToken is created per generation and passed down to every LLM call
+it makes. Cancelling it stops new calls, wakes the call layer out of its
+waits and shuts down the sockets of the token's HTTP client, so in-flight
+provider requests are aborted instead of running (and billing) to the end.
+A token can also be detached instead: the generation then runs to
+completion but its result is treated as unserved.
+
+The call layer gives each attempt of a call a child token, so a hedged
+attempt that lost the race can be aborted on its own. HTTP clients are
+lent to one token at a time and returned to a shared pool when the token
+closes uncancelled, so connections are still reused across calls.
+"""
+import logging
+import socket
+import ssl
+import threading
+import weakref
+from collections import Counter
+from typing import Callable, Optional
+
+import httpx
+
+
+class GenerationCancelled(BaseException):
+    """Raised inside a cancelled generation.
+
+    Derives from BaseException (like asyncio.CancelledError) so the
+    pipeline's broad ``except Exception`` fallbacks do not swallow it.
+    """
+
+
+class _ConnectionTracker:
+    """Remembers the sockets an HTTP client opens so they can be torn down.
+
+    Hooked in through httpcore's public "trace" request extension, which
+    reports every new connection (directly or through a proxy) of the client.
+    """
+
+    def __init__(self):
+        self._streams: "weakref.WeakSet" = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def trace(self, event: str, info: dict) -> None:
+        if event.endswith(("connect_tcp.complete", "start_tls.complete")):
+            stream = info.get("return_value")
+            if stream is not None:
+                with self._lock:
+                    self._streams.add(stream)
+
+    def abort(self) -> None:
+        with self._lock:
+            streams = list(self._streams)
+        for stream in streams:
+            # Closing alone does not wake a thread blocked in recv(); shutdown does
+            sock = stream.get_extra_info("socket")
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+_ssl_context: Optional[ssl.SSLContext] = None
+_ssl_lock = threading.Lock()
+
+
+def _shared_ssl_context() -> ssl.SSLContext:
+    # Loading the CA bundle costs ~50ms of CPU; do it once, not per client
+    global _ssl_context
+    with _ssl_lock:
+        if _ssl_context is None:
+            _ssl_context = httpx.create_ssl_context()
+        return _ssl_context
+
+
+class _AbortableClient:
+    """An httpx client whose connections can be torn down; used by one token at a time."""
+
+    def __init__(self, timeout: Optional[float]):
+        self.owner: Optional["CancelToken"] = None
+        self.tracker = _ConnectionTracker()
+        self.client = httpx.Client(
+            timeout=timeout,
+            verify=_shared_ssl_context(),
+            event_hooks={"request": [self._before_request]}
+        )
+
+    def _before_request(self, request: httpx.Request) -> None:
+        owner = self.owner
+        if owner is not None:
+            # Also stops the client's own retry after an aborted attempt
+            owner.raise_if_cancelled()
+        request.extensions["trace"] = self.tracker.trace
+
+
+# Clients of tokens that closed without being cancelled, ready for reuse
+MAX_IDLE_CLIENTS = 16
+_idle_clients: list[_AbortableClient] = []
+_idle_lock = threading.Lock()
+
+
+def _borrow_client(timeout: Optional[float]) -> _AbortableClient:
+    with _idle_lock:
+        if _idle_clients:
+            return _idle_clients.pop()
+    return _AbortableClient(timeout)
+
+
+def _return_client(client: _AbortableClient) -> None:
+    client.owner = None
+    with _idle_lock:
+        if len(_idle_clients) < MAX_IDLE_CLIENTS:
+            _idle_clients.append(client)
+            return
+    client.client.close()
+
+
+class CancelToken:
+    """Cancellation signal for one generation, shared by all of its LLM calls.
+
+    A child token (see child) is cancelled with its parent but can also be
+    cancelled on its own.
+    """
+
+    def __init__(self, parent: Optional["CancelToken"] = None):
+        self.reason: Optional[str] = None
+        self.parent = parent
+        self._cancelled = threading.Event()
+        self._detached = False
+        self._lock = threading.Lock()
+        self._callbacks: list[Callable[[], None]] = []
+        self._client: Optional[_AbortableClient] = None
+        self._unlink = parent.on_cancel(lambda: self.cancel(parent.reason)) if parent else None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def detached(self) -> bool:
+        """Whether the requester left but the generation should still finish."""
+        return self._detached or (self.parent is not None and self.parent.detached)
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Abort the generation; returns False if it was already cancelled."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            self.reason = reason
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in cancel callback: {str(e)}")
+        return True
+
+    def detach(self) -> None:
+        """Let the generation finish without a requester waiting for it."""
+        self._detached = True
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds, waking early on cancellation; returns whether cancelled."""
+        return self._cancelled.wait(timeout)
+
+    def raise_if_cancelled(self) -> None:
+        if self._cancelled.is_set():
+            raise GenerationCancelled(self.reason)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback on cancellation (now, if already cancelled); returns an unregister function."""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+
+                def unregister() -> None:
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return unregister
+        callback()
+        return lambda: None
+
+    def child(self) -> "CancelToken":
+        """Token for one attempt of a call, cancelled with this token or on its own."""
+        return CancelToken(parent=self)
+
+    def http_client(self, timeout: Optional[float] = None) -> httpx.Client:
+        """HTTP client for this token's provider calls, aborted on cancel.
+
+        timeout is the default of a newly created client; reused clients
+        keep theirs, so pass the timeout per request as well.
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = _borrow_client(timeout)
+                self._client.owner = self
+                self._callbacks.append(self._client.tracker.abort)
+            return self._client.client
+
+    def close(self) -> None:
+        """Release the HTTP client once the generation (or attempt) is over."""
+        with self._lock:
+            client, self._client = self._client, None
+            # Decided under the lock: cancel() either ran already or can no longer abort the client
+            aborted = self._cancelled.is_set()
+            if client is not None and client.tracker.abort in self._callbacks:
+                self._callbacks.remove(client.tracker.abort)
+        if self._unlink is not None:
+            self._unlink()
+        if client is None:
+            return
+        if aborted:
+            # Its connections were shut down; don't hand them to anyone else
+            client.client.close()
+        else:
+            _return_client(client)
+
+    def __enter__(self) -> "CancelToken":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CancellationStats:
+    """Counts cancelled generations and the output tokens they did not spend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = 0
+        self._by_stage: Counter = Counter()
+        self._tokens_saved = 0
+        self._finished_detached = 0
+
+    def record_cancelled(self, stage: str, tokens_saved: int) -> None:
+        """Record a generation cancelled during stage (or "queued")."""
+        with self._lock:
+            self._cancelled += 1
+            self._by_stage[stage] += 1
+            self._tokens_saved += tokens_saved
+
+    def record_finished_detached(self) -> None:
+        with self._lock:
+            self._finished_detached += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "cancelled": self._cancelled,
+                "cancelled_by_stage": dict(self._by_stage),
+                "estimated_tokens_saved": self._tokens_saved,
+                "finished_after_cancel": self._finished_detached,
+            }
+
+
+_stats = CancellationStats()
+
+
+def get_cancellation_stats() -> CancellationStats:
+    """Return the process-wide cancellation counters."""
+    return _stats
@@ -0,0 +1,199 @@
+"""Record/replay cassettes for provider calls.
+
+In record mode every provider response is appended to a gzipped JSON-lines
+file together with its request fingerprint, token usage and latency. In
+replay mode responses are served from that file, sleeping for the recorded
+latency (optionally scaled) instead of calling the provider.
+
+Configured through environment variables:
+    LLM_CASSETTE_MODE        off (default), record or replay
+    LLM_CASSETTE_PATH        cassette file, defaults to .story_data/llm_cassette.jsonl.gz
+    LLM_CASSETTE_TIME_SCALE  latency multiplier in replay mode (0 disables sleeping)
+    LLM_CASSETTE_STRICT      1 to fail requests without an exact recorded match
+                             instead of replaying another response of the same kind
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Literal
+
+from pydantic import BaseModel, Field
+
+from src.storage import data_path
+from .cancellation import CancelToken, GenerationCancelled
+
+CassetteMode = Literal["off", "record", "replay"]
+ResponseKind = Literal["langchain", "openai"]
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when no recorded response can be served."""
+
+
+class CassetteEntry(BaseModel):
+    """One recorded provider response."""
+    fingerprint: str = Field(description="Hash of the request (model, messages, sampling params)")
+    label: str = Field(description="Call kind, e.g. planner or simple")
+    kind: ResponseKind = Field(description="Client that produced the response")
+    content: str = Field(description="Response message content")
+    usage: dict = Field(default_factory=dict, description="Token usage reported by the provider")
+    latency: float = Field(description="Observed latency in seconds")
+    recorded_at: float = Field(default_factory=time.time, description="Unix time of recording")
+
+
+def fingerprint(request: dict) -> str:
+    """Stable hash of a request description."""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+
+def _extract(response: Any) -> tuple[ResponseKind, str, dict]:
+    """Pull content and usage out of an OpenAI or langchain response."""
+    if hasattr(response, "choices"):
+        usage = response.usage.model_dump() if getattr(response, "usage", None) else {}
+        return "openai", response.choices[0].message.content or "", usage
+    return "langchain", response.content, dict(getattr(response, "usage_metadata", None) or {})
+
+
+def _rebuild(entry: CassetteEntry) -> Any:
+    """Turn a recorded entry back into the response type its client returns."""
+    if entry.kind == "openai":
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate({
+            "id": f"cassette-{entry.fingerprint}",
+            "object": "chat.completion",
+            "created": int(entry.recorded_at),
+            "model": "cassette",
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": entry.content},
+            }],
+            "usage": entry.usage or None,
+        })
+    from langchain_core.messages import AIMessage
+    return AIMessage(content=entry.content, usage_metadata=entry.usage or None)
+
+
+class Cassette:
+    """A cassette file plus the record/replay behaviour around it."""
+
+    def __init__(self, path: str, mode: CassetteMode = "off", time_scale: float = 1.0, strict: bool = False):
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._by_fingerprint: dict[str, itertools.cycle] = {}
+        self._by_label: dict[str, list[CassetteEntry]] = defaultdict(list)
+        self._recorded = 0
+        self._hits = 0
+        self._misses = 0
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        grouped: dict[str, list[CassetteEntry]] = defaultdict(list)
+        if os.path.exists(self.path):
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = CassetteEntry.model_validate_json(line)
+                        grouped[entry.fingerprint].append(entry)
+                        self._by_label[entry.label].append(entry)
+        self._by_fingerprint = {fp: itertools.cycle(entries) for fp, entries in grouped.items()}
+        logging.info(f"Loaded {sum(map(len, grouped.values()))} cassette entries from {self.path}")
+
+    def record(self, entry: CassetteEntry) -> None:
+        """Append an entry to the cassette file."""
+        line = entry.model_dump_json() + "\n"
+        with self._lock:
+            # Each append adds a gzip member; gzip.open reads them back as one stream
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            self._recorded += 1
+
+    def lookup(self, fp: str, label: str) -> CassetteEntry:
+        """Find the recorded entry for a request.
+
+        Without an exact match a strict cassette raises; otherwise it logs the
+        miss and falls back to a random entry of the same call kind.
+        """
+        with self._lock:
+            entries = self._by_fingerprint.get(fp)
+            if entries is not None:
+                self._hits += 1
+                return next(entries)
+            candidates = self._by_label.get(label)
+            self._misses += 1
+        if self.strict or not candidates:
+            raise CassetteMissError(f"No recorded '{label}' response for request {fp} in {self.path}")
+        # Upstream outputs can differ between runs (e.g. plans), so prompts may not match exactly
+        logging.warning(f"No recorded response for '{label}' request {fp}, replaying another '{label}' response")
+        return random.choice(candidates)
+
+    def wrap(
+        self,
+        send: Callable[[CancelToken], Any],
+        request: dict,
+        label: str
+    ) -> Callable[[CancelToken], Any]:
+        """Return a send function that records or replays according to the mode."""
+        fp = fingerprint(request)
+
+        if self.mode == "replay":
+            def replay(token: CancelToken) -> Any:
+                entry = self.lookup(fp, label)
+                # Wakes early if the attempt is aborted, e.g. after losing a hedge
+                if self.time_scale > 0 and token.wait(entry.latency * self.time_scale):
+                    raise GenerationCancelled(token.reason)
+                return _rebuild(entry)
+            return replay
+
+        if self.mode == "record":
+            def record(token: CancelToken) -> Any:
+                started = time.monotonic()
+                response = send(token)
+                kind, content, usage = _extract(response)
+                self.record(CassetteEntry(
+                    fingerprint=fp,
+                    label=label,
+                    kind=kind,
+                    content=content,
+                    usage=usage,
+                    latency=time.monotonic() - started,
+                ))
+                return response
+            return record
+
+        return send
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "recorded": self._recorded,
+                "replay_hits": self._hits,
+                "replay_misses": self._misses,
+            }
+
+
+def cassette_from_env() -> Cassette:
+    """Build the cassette configured by the LLM_CASSETTE_* environment variables."""
+    mode = os.environ.get("LLM_CASSETTE_MODE", "off").lower()
+    if mode not in ("off", "record", "replay"):
+        logging.warning(f"Unknown LLM_CASSETTE_MODE '{mode}', cassette disabled")
+        mode = "off"
+    path = os.environ.get("LLM_CASSETTE_PATH") or (
+        str(data_path("llm_cassette.jsonl.gz")) if mode != "off" else ""
+    )
+    time_scale = float(os.environ.get("LLM_CASSETTE_TIME_SCALE", "1.0"))
+    strict = os.environ.get("LLM_CASSETTE_STRICT", "").lower() in ("1", "true", "yes")
+    return Cassette(path, mode=mode, time_scale=time_scale, strict=strict)
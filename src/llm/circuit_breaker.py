@@ -0,0 +1,134 @@
+"""Circuit breaker around provider calls."""
+import threading
+import time
+from collections import deque
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+BreakerState = Literal["closed", "open", "half_open"]
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the provider looks unhealthy."""
+
+
+class CircuitBreakerConfig(BaseModel):
+    """Thresholds for tripping and restoring the circuit breaker."""
+    window_seconds: float = Field(default=60.0, description="Sliding window used for error and latency rates")
+    min_calls: int = Field(default=5, description="Calls in the window needed before the breaker can trip")
+    error_rate_threshold: float = Field(default=0.5, description="Failure fraction that opens the breaker")
+    slow_call_seconds: float = Field(default=45.0, description="Latency above which a call counts as slow")
+    slow_rate_threshold: float = Field(default=0.8, description="Slow-call fraction that opens the breaker")
+    open_seconds: float = Field(default=30.0, description="Time spent open before probing again")
+    half_open_probes: int = Field(default=1, description="Concurrent probe calls allowed while half-open")
+
+
+class CircuitBreaker:
+    """Tracks provider health over a sliding window of recent calls.
+
+    closed -> open when the error or slow-call rate crosses its threshold.
+    open -> half_open once open_seconds have passed, admitting a few probes.
+    half_open -> closed on a successful probe, or back to open on failure.
+    """
+
+    def __init__(self, config: CircuitBreakerConfig | None = None):
+        self.config = config or CircuitBreakerConfig()
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque()  # (timestamp, ok, latency)
+        self._state: BreakerState = "closed"
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._rejected = 0
+        self._times_opened = 0
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.config.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def _refresh_state(self, now: float) -> None:
+        if self._state == "open" and now - self._opened_at >= self.config.open_seconds:
+            self._state = "half_open"
+            self._probes_in_flight = 0
+
+    def _trip(self, now: float) -> None:
+        self._state = "open"
+        self._opened_at = now
+        self._probes_in_flight = 0
+        self._times_opened += 1
+
+    @property
+    def state(self) -> BreakerState:
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected outright (no probe slot either)."""
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            if self._state == "open":
+                return True
+            if self._state == "half_open":
+                return self._probes_in_flight >= self.config.half_open_probes
+            return False
+
+    def allow_request(self) -> bool:
+        """Admit a call, reserving a probe slot when half-open."""
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            if self._state == "closed":
+                return True
+            if self._state == "half_open" and self._probes_in_flight < self.config.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self._rejected += 1
+            return False
+
+    def release(self) -> None:
+        """Give back an admitted call's probe slot without judging provider health."""
+        with self._lock:
+            if self._state == "half_open":
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record(self, ok: bool, latency: float) -> None:
+        """Record the outcome of an admitted call."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == "half_open":
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if ok and latency < self.config.slow_call_seconds:
+                    self._state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self._trip(now)
+                return
+
+            self._outcomes.append((now, ok, latency))
+            self._prune(now)
+            if self._state != "closed" or len(self._outcomes) < self.config.min_calls:
+                return
+
+            total = len(self._outcomes)
+            failures = sum(1 for _, success, _ in self._outcomes if not success)
+            slow = sum(1 for _, _, lat in self._outcomes if lat >= self.config.slow_call_seconds)
+            if (failures / total >= self.config.error_rate_threshold
+                    or slow / total >= self.config.slow_rate_threshold):
+                self._trip(now)
+
+    def metrics(self) -> dict:
+        """Return current state and window statistics."""
+        with self._lock:
+            now = time.monotonic()
+            self._refresh_state(now)
+            self._prune(now)
+            total = len(self._outcomes)
+            failures = sum(1 for _, success, _ in self._outcomes if not success)
+            return {
+                "state": self._state,
+                "window_calls": total,
+                "window_error_rate": failures / total if total else 0.0,
+                "rejected": self._rejected,
+                "times_opened": self._times_opened,
+            }
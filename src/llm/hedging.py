@@ -0,0 +1,231 @@
+"""Request hedging for LLM calls to cut tail latency."""
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Optional, TypeVar
+
+from pydantic import BaseModel, Field
+
+from src.profiling import carry_profile
+from .cancellation import CancelToken, GenerationCancelled
+
+T = TypeVar("T")
+
+
+class HedgingConfig(BaseModel):
+    """Tuning knobs for hedged LLM requests."""
+    enabled: bool = Field(default=True, description="Whether duplicate requests may be issued")
+    percentile: float = Field(default=0.95, description="Latency percentile after which a hedge is sent")
+    initial_delay: float = Field(default=20.0, description="Hedge delay in seconds before enough samples exist")
+    min_delay: float = Field(default=2.0, description="Lower bound on the hedge delay in seconds")
+    min_samples: int = Field(default=10, description="Samples needed before the percentile is trusted")
+    window_size: int = Field(default=200, description="Number of recent latencies kept per call label")
+    attempt_timeout: float = Field(default=90.0, description="Timeout in seconds for a single attempt")
+    max_extra_ratio: float = Field(default=0.1, description="Max hedges as a fraction of all calls")
+    burst: int = Field(default=2, description="Hedges allowed before the ratio budget applies")
+
+
+class HedgedExecutor:
+    """Runs a call and issues one duplicate if it is slower than usual.
+
+    Latencies are tracked per label (e.g. "writer", "simple") so that each
+    call kind gets its own hedge delay. The first attempt to succeed wins.
+
+    Each attempt runs on its own thread, so attempts never queue behind
+    other requests' calls, and gets its own child CancelToken: attempts
+    still running once the call is decided (the loser of a hedge, or all of
+    them on timeout) are aborted instead of running and billing to the end.
+    """
+
+    def __init__(self, config: HedgingConfig | None = None):
+        self.config = config or HedgingConfig()
+        self._lock = threading.Lock()
+        self._latencies: dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=self.config.window_size)
+        )
+        self._calls = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._budget_denied = 0
+        self._timeouts = 0
+        self._aborted = 0
+        self._latency_saved = 0.0
+
+    def hedge_delay(self, label: str) -> float:
+        """Return the delay after which a duplicate is issued for this label."""
+        with self._lock:
+            samples = sorted(self._latencies[label])
+        if len(samples) < self.config.min_samples:
+            return self.config.initial_delay
+        index = min(len(samples) - 1, int(self.config.percentile * len(samples)))
+        return max(self.config.min_delay, samples[index])
+
+    def _take_hedge_budget(self) -> bool:
+        with self._lock:
+            allowed = self.config.max_extra_ratio * self._calls + self.config.burst
+            if self._hedges >= allowed:
+                self._budget_denied += 1
+                return False
+            self._hedges += 1
+            return True
+
+    def _record_latency(self, label: str, latency: float) -> None:
+        with self._lock:
+            self._latencies[label].append(latency)
+
+    def _attempt(self, call: Callable[[CancelToken], T], label: str, token: CancelToken) -> tuple[T, float, float]:
+        try:
+            started = time.monotonic()
+            result = call(token)
+            finished = time.monotonic()
+        finally:
+            token.close()
+        self._record_latency(label, finished - started)
+        return result, started, finished
+
+    @staticmethod
+    def _start(fn: Callable[..., T], *args) -> Future:
+        """Run fn on a new thread; the future also carries BaseExceptions such as GenerationCancelled."""
+        future: Future = Future()
+
+        def run() -> None:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True, name="llm-attempt").start()
+        return future
+
+    def run(
+        self,
+        call: Callable[[CancelToken], T],
+        label: str = "default",
+        timeout: float | None = None,
+        cancel_token: Optional[CancelToken] = None
+    ) -> T:
+        """Run call, hedging it once if it exceeds the label's latency percentile.
+
+        call gets the CancelToken of its attempt (a child of cancel_token)
+        and should send its requests through that token's http_client.
+        """
+        timeout = timeout or self.config.attempt_timeout
+        with self._lock:
+            self._calls += 1
+
+        if not self.config.enabled:
+            with cancel_token.child() if cancel_token else CancelToken() as token:
+                return call(token)
+
+        # Completes on cancellation so the waits below return right away
+        cancelled: Future = Future()
+        unregister = cancel_token.on_cancel(lambda: cancelled.set_result(None)) if cancel_token else None
+        try:
+            return self._run_hedged(call, label, timeout, cancel_token, cancelled)
+        finally:
+            if unregister:
+                unregister()
+
+    def _run_hedged(
+        self,
+        call: Callable[[CancelToken], T],
+        label: str,
+        timeout: float,
+        cancel_token: Optional[CancelToken],
+        cancelled: Future
+    ) -> T:
+        deadline = time.monotonic() + timeout
+        # Sample the attempt threads while they work for a profiled request
+        attempt = carry_profile(self._attempt)
+        tokens: dict[Future, CancelToken] = {}
+
+        def start() -> Future:
+            token = cancel_token.child() if cancel_token else CancelToken()
+            future = self._start(attempt, call, label, token)
+            tokens[future] = token
+            return future
+
+        try:
+            return self._race(start, label, timeout, deadline, cancelled)
+        finally:
+            for future, token in tokens.items():
+                if not future.done() and token.cancel(f"LLM call '{label}' already decided"):
+                    with self._lock:
+                        self._aborted += 1
+
+    def _race(
+        self,
+        start: Callable[[], Future],
+        label: str,
+        timeout: float,
+        deadline: float,
+        cancelled: Future
+    ) -> T:
+        primary_started = time.monotonic()
+        primary = start()
+        pending: set[Future] = {primary}
+
+        done, _ = wait(
+            pending | {cancelled},
+            timeout=min(self.hedge_delay(label), timeout),
+            return_when=FIRST_COMPLETED
+        )
+        if not done and self._take_hedge_budget():
+            logging.info(f"Hedging slow '{label}' LLM call")
+            pending.add(start())
+
+        last_error: Exception | None = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if cancelled.done():
+                raise GenerationCancelled(f"LLM call '{label}' cancelled")
+            done, pending = wait(pending | {cancelled}, timeout=remaining, return_when=FIRST_COMPLETED)
+            pending.discard(cancelled)
+            for future in done:
+                if future is cancelled:
+                    continue
+                try:
+                    result, _, finished = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if future is not primary:
+                    self._record_hedge_win(label, finished - primary_started)
+                return result
+
+        if last_error is not None and not pending:
+            raise last_error
+        with self._lock:
+            self._timeouts += 1
+        raise TimeoutError(
+            f"LLM call '{label}' timed out after {timeout:.0f}s"
+        )
+
+    def _record_hedge_win(self, label: str, primary_elapsed: float) -> None:
+        # The losing primary is aborted, so estimate its remaining time from
+        # recent calls of this kind that took longer than it had so far
+        with self._lock:
+            self._hedge_wins += 1
+            remaining = [latency - primary_elapsed for latency in self._latencies[label] if latency > primary_elapsed]
+            if remaining:
+                self._latency_saved += sum(remaining) / len(remaining)
+
+    def metrics(self) -> dict:
+        """Return hedge rate, win rate, aborted attempts and (estimated) latency saved so far."""
+        with self._lock:
+            calls = self._calls
+            return {
+                "calls": calls,
+                "hedges": self._hedges,
+                "hedge_rate": self._hedges / calls if calls else 0.0,
+                "hedge_wins": self._hedge_wins,
+                "budget_denied": self._budget_denied,
+                "timeouts": self._timeouts,
+                "attempts_aborted": self._aborted,
+                "latency_saved_seconds": round(self._latency_saved, 3),
+            }
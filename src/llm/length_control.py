@@ -0,0 +1,179 @@
+"""Per-language output length control.
+
+Hindi (Devanagari) and Hinglish need far more tokens per word than English,
+so a single max_tokens for every language either truncates Hindi stories or
+lets English ones run long. The controller learns tokens-per-word for each
+language from finished outputs and derives per-node token caps and word
+limits from it.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from src.storage import data_path
+
+# Starting estimates until enough outputs have been observed
+DEFAULT_TOKENS_PER_WORD = {
+    "english": 1.35,
+    "hinglish": 2.1,
+    "hindi": 4.0,
+}
+
+# Expected output length of each call kind, in words
+NODE_WORD_BUDGETS = {
+    "planner": 220,
+    "writer": 350,
+    "reviewer": 120,
+    "enhancer": 350,
+    "simple": 350,
+}
+
+# Models that spend hidden reasoning tokens out of max_tokens before any visible text
+REASONING_MODEL_PREFIXES = ("gpt-5", "o1", "o3", "o4")
+
+_SENTENCE_END = re.compile(r"[.!?।][\"'”’)]*(?=\s|$)")
+
+
+class LengthControlConfig(BaseModel):
+    """Tuning knobs for length control."""
+    token_headroom: float = Field(default=1.4, description="max_tokens as a multiple of the expected token count")
+    word_overshoot: float = Field(default=1.15, description="Streamed outputs are cut off past budget times this")
+    reasoning_allowance: int = Field(default=4096, description="Extra tokens for reasoning models, whose hidden reasoning counts against max_tokens")
+    smoothing: float = Field(default=0.2, description="Weight of a new observation in the moving average")
+    persist: bool = Field(default=True, description="Save learned ratios to the data directory")
+
+
+def count_words(text: str) -> int:
+    """Count whitespace-separated words."""
+    return len(text.split())
+
+
+def trim_to_sentence(text: str, max_words: int) -> str:
+    """Cut text to at most max_words, ending at the last complete sentence."""
+    words = text.split()
+    if len(words) <= max_words:
+        return text
+    # Find the character offset where word max_words ends
+    offset = 0
+    for match in re.finditer(r"\S+", text):
+        offset = match.end()
+        max_words -= 1
+        if max_words == 0:
+            break
+    head = text[:offset]
+    ends = list(_SENTENCE_END.finditer(head))
+    return head[:ends[-1].end()] if ends else head
+
+
+class LengthController:
+    """Learns tokens-per-word per language and sets output caps from it."""
+
+    def __init__(self, config: Optional[LengthControlConfig] = None):
+        self.config = config or LengthControlConfig()
+        self._lock = threading.Lock()
+        self._ratios: dict[str, float] = dict(DEFAULT_TOKENS_PER_WORD)
+        self._observations: dict[str, int] = {}
+        self._cutoffs = 0
+        if self.config.persist:
+            self._load()
+
+    def _path(self):
+        return data_path("length_stats.json")
+
+    def _load(self) -> None:
+        try:
+            with open(self._path(), encoding="utf-8") as f:
+                saved = json.load(f)
+            self._ratios.update(saved.get("tokens_per_word", {}))
+            self._observations.update(saved.get("observations", {}))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Could not load length stats: {str(e)}")
+
+    def _save(self) -> None:
+        # Other processes read this file too: write a temp file and swap it in
+        path = self._path()
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"tokens_per_word": self._ratios, "observations": self._observations}, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logging.warning(f"Could not save length stats: {str(e)}")
+
+    def tokens_per_word(self, language: str) -> float:
+        with self._lock:
+            return self._ratios.get(language.lower(), 1.6)
+
+    def word_budget(self, node: str) -> int:
+        return NODE_WORD_BUDGETS.get(node, 350)
+
+    def word_limit(self, node: str) -> int:
+        """Word count past which a streamed output is cut off."""
+        return int(self.word_budget(node) * self.config.word_overshoot)
+
+    def expected_tokens(self, language: str, node: str) -> int:
+        """Expected visible output tokens of a call kind in the given language."""
+        return int(self.word_budget(node) * self.tokens_per_word(language))
+
+    def max_tokens(self, language: str, node: str, model: str = "gpt-5-mini") -> int:
+        """Output token cap (visible plus reasoning tokens) for a call kind in the given language."""
+        expected = self.word_budget(node) * self.tokens_per_word(language)
+        cap = int(expected * self.config.token_headroom)
+        if model.startswith(REASONING_MODEL_PREFIXES):
+            cap += self.config.reasoning_allowance
+        return cap
+
+    def observe(self, language: str, text: str, output_tokens: Optional[int]) -> None:
+        """
+        Update the language's tokens-per-word estimate from a finished output.
+
+        output_tokens should exclude reasoning tokens, which do not produce text.
+        """
+        words = count_words(text)
+        if not output_tokens or words < 20:
+            return
+        ratio = output_tokens / words
+        key = language.lower()
+        with self._lock:
+            current = self._ratios.get(key, ratio)
+            self._ratios[key] = (1 - self.config.smoothing) * current + self.config.smoothing * ratio
+            self._observations[key] = self._observations.get(key, 0) + 1
+            if self.config.persist:
+                self._save()
+
+    def record_cutoff(self) -> None:
+        with self._lock:
+            self._cutoffs += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "tokens_per_word": {k: round(v, 3) for k, v in self._ratios.items()},
+                "observations": dict(self._observations),
+                "cutoffs": self._cutoffs,
+            }
+
+
+_controller: Optional[LengthController] = None
+_controller_lock = threading.Lock()
+
+
+def get_length_controller() -> LengthController:
+    """Return the process-wide length controller."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = LengthController()
+        return _controller
@@ -0,0 +1,375 @@
+"""Provider endpoints and routing for every LLM request the app makes.
+
+Both the agent pipeline (langchain ChatOpenAI) and simple mode (openai
+client) send their requests through a ProviderRouter. It knows a list of
+OpenAI-compatible endpoints (OpenAI itself, or a local llama.cpp / vLLM
+server) and picks one per request:
+
+- "latency" routing prefers the endpoint with the lowest recent latency
+  for the call kind, and spreads concurrent (e.g. hedged) attempts over
+  endpoints;
+- "failover" routing uses the endpoints in configured order.
+
+Either way a failed request is retried on the next endpoint, and an
+endpoint that keeps failing is skipped for a cooldown period. With more
+than one endpoint each request gets a shorter per-endpoint timeout, so a
+hung endpoint still leaves time to fail over within the call layer's
+attempt timeout.
+
+Endpoints come from the LLM_PROVIDERS environment variable, a JSON list
+such as ``[{"name": "local", "base_url": "http://127.0.0.1:8001/v1"},
+{"name": "openai"}]``; without it the app talks to OpenAI only.
+LLM_ROUTING selects the strategy.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterator, Literal, Optional, TypeVar
+
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, Field
+
+from .calls import attempt_timeout
+from .cancellation import CancelToken, GenerationCancelled
+
+T = TypeVar("T")
+
+# Client errors that would fail the same way on every endpoint
+_NO_FAILOVER_STATUS = {400, 404, 413, 422}
+
+# response_metadata key under which RoutedChatModel reports the model that served a response
+SERVED_MODEL = "served_model"
+
+
+class ProviderEndpoint(BaseModel):
+    """One OpenAI-compatible endpoint."""
+    name: str = Field(description="Name used in logs and metrics")
+    base_url: Optional[str] = Field(default=None, description="API base URL; None means OpenAI (or OPENAI_BASE_URL)")
+    api_key: Optional[str] = Field(default=None, description="API key; defaults to the app's OpenAI key")
+    api_key_env: Optional[str] = Field(default=None, description="Environment variable to read the API key from")
+    model: Optional[str] = Field(default=None, description="Model to request here instead of the app's default")
+
+
+class RoutingConfig(BaseModel):
+    """Tuning knobs for provider routing."""
+    strategy: Literal["latency", "failover"] = Field(default="latency", description="How endpoints are ordered per request")
+    failure_threshold: int = Field(default=2, description="Consecutive failures before an endpoint cools down")
+    cooldown_seconds: float = Field(default=30.0, description="How long a failing endpoint is skipped")
+    smoothing: float = Field(default=0.3, description="Weight of a new latency sample in the moving average")
+    endpoint_timeout: float = Field(default=40.0, description="Request timeout per endpoint when others can take over")
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.latency: dict[str, float] = {}
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+
+def _is_failover_error(error: Exception) -> bool:
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code not in _NO_FAILOVER_STATUS
+    return True
+
+
+class ProviderRouter:
+    """Chooses an endpoint per request and fails over to the others."""
+
+    def __init__(self, endpoints: list[ProviderEndpoint], config: Optional[RoutingConfig] = None):
+        if not endpoints:
+            raise ValueError("At least one provider endpoint is required")
+        self.endpoints = endpoints
+        self.config = config or RoutingConfig()
+        self._lock = threading.Lock()
+        self._stats = {endpoint.name: _EndpointStats() for endpoint in endpoints}
+        self._clients: dict[tuple[str, Optional[str]], openai.OpenAI] = {}
+
+    def api_key(self, endpoint: ProviderEndpoint, default: Optional[str] = None) -> str:
+        """Key for the endpoint; local servers usually accept any value."""
+        if endpoint.api_key:
+            return endpoint.api_key
+        if endpoint.api_key_env and os.environ.get(endpoint.api_key_env):
+            return os.environ[endpoint.api_key_env]
+        return default or os.environ.get("OPENAI_API_KEY") or "not-needed"
+
+    def request_timeout(self, timeout: float) -> float:
+        """Timeout for one endpoint out of a call's overall timeout."""
+        if len(self.endpoints) == 1:
+            return timeout
+        return min(timeout, self.config.endpoint_timeout)
+
+    def client_retries(self) -> int:
+        """Retries for the provider clients; with several endpoints failover takes their place."""
+        return 1 if len(self.endpoints) == 1 else 0
+
+    def order(self, label: str = "default") -> list[ProviderEndpoint]:
+        """Endpoints to try for a call kind, best first; cooling-down ones come last."""
+        now = time.monotonic()
+        with self._lock:
+            def rank(item: tuple[int, ProviderEndpoint]) -> tuple:
+                position, endpoint = item
+                stats = self._stats[endpoint.name]
+                cooling = stats.cooldown_until > now
+                if self.config.strategy == "failover":
+                    return (cooling, position)
+                # Untried endpoints get measured first; busy ones look proportionally slower
+                latency = stats.latency.get(label, 0.0) * (1 + stats.in_flight)
+                return (cooling, latency, position)
+
+            return [endpoint for _, endpoint in sorted(enumerate(self.endpoints), key=rank)]
+
+    def _started(self, endpoint: ProviderEndpoint) -> None:
+        with self._lock:
+            stats = self._stats[endpoint.name]
+            stats.in_flight += 1
+            stats.calls += 1
+
+    def _finished(self, endpoint: ProviderEndpoint, label: str, ok: bool, latency: float) -> None:
+        with self._lock:
+            stats = self._stats[endpoint.name]
+            stats.in_flight -= 1
+            if ok:
+                stats.consecutive_failures = 0
+                previous = stats.latency.get(label)
+                stats.latency[label] = latency if previous is None else (
+                    self.config.smoothing * latency + (1 - self.config.smoothing) * previous
+                )
+                return
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.config.failure_threshold:
+                stats.cooldown_until = time.monotonic() + self.config.cooldown_seconds
+
+    def _abandoned(self, endpoint: ProviderEndpoint) -> None:
+        # A cancelled call says nothing about the endpoint's health
+        with self._lock:
+            self._stats[endpoint.name].in_flight -= 1
+
+    def run(
+        self,
+        call: Callable[[ProviderEndpoint], T],
+        label: str = "default",
+        cancel_token: Optional[CancelToken] = None
+    ) -> T:
+        """
+        Run call against the best endpoint, failing over to the others.
+
+        Args:
+            call: Sends one request to the given endpoint
+            label: Call kind; latency is tracked per endpoint and kind
+            cancel_token: Token of the generation; errors caused by aborting
+                it are not held against the endpoint
+
+        Returns:
+            The first successful result
+
+        Raises:
+            The last endpoint's error if every endpoint failed, or a client
+            error (e.g. 400) right away since other endpoints would reject it too
+        """
+        last_error: Optional[Exception] = None
+        for endpoint in self.order(label):
+            self._started(endpoint)
+            started = time.monotonic()
+            try:
+                result = call(endpoint)
+            except Exception as e:
+                if cancel_token is not None and cancel_token.cancelled:
+                    self._abandoned(endpoint)
+                    raise GenerationCancelled(cancel_token.reason) from e
+                self._finished(endpoint, label, False, time.monotonic() - started)
+                if not _is_failover_error(e):
+                    raise
+                logging.warning(f"Provider '{endpoint.name}' failed for '{label}': {str(e)}")
+                last_error = e
+                continue
+            except BaseException:
+                self._abandoned(endpoint)
+                raise
+            self._finished(endpoint, label, True, time.monotonic() - started)
+            return result
+        raise last_error
+
+    def openai_client(
+        self,
+        endpoint: ProviderEndpoint,
+        api_key: Optional[str] = None,
+        timeout: Optional[float] = None,
+        http_client: Optional[httpx.Client] = None
+    ) -> openai.OpenAI:
+        """openai client for the endpoint; timeout and http_client apply to this use only."""
+        key = self.api_key(endpoint, api_key)
+        with self._lock:
+            client = self._clients.get((endpoint.name, key))
+            if client is None:
+                client = openai.OpenAI(
+                    api_key=key,
+                    base_url=endpoint.base_url,
+                    timeout=attempt_timeout(),
+                    max_retries=self.client_retries()  # Slow attempts are hedged by the call layer instead
+                )
+                self._clients[(endpoint.name, key)] = client
+        options = {}
+        if timeout:
+            options["timeout"] = timeout
+        if http_client is not None:
+            options["http_client"] = http_client
+        return client.with_options(**options) if options else client
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "strategy": self.config.strategy,
+                "endpoints": {
+                    name: {
+                        "calls": stats.calls,
+                        "failures": stats.failures,
+                        "in_flight": stats.in_flight,
+                        "cooling_down": stats.cooldown_until > now,
+                        "latency_seconds": {label: round(value, 3) for label, value in stats.latency.items()},
+                    }
+                    for name, stats in self._stats.items()
+                },
+            }
+
+
+class RoutedChatModel:
+    """Chat model with the ChatOpenAI calls the agents use, sent through a ProviderRouter.
+
+    Streams fail over only until their first chunk arrives; their latency
+    is the time to that first chunk. Responses (and a stream's first chunk)
+    carry the model of the endpoint that served them under
+    response_metadata[SERVED_MODEL], since endpoints may override the model.
+    """
+
+    def __init__(
+        self,
+        router: ProviderRouter,
+        model: str,
+        temperature: float,
+        max_tokens: Optional[int] = None,
+        api_key: Optional[str] = None,
+        cancel_token: Optional[CancelToken] = None,
+        label: str = "default",
+        **kwargs
+    ):
+        self.router = router
+        self.model_name = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.api_key = api_key
+        self.cancel_token = cancel_token
+        self.label = label
+        self.kwargs = kwargs
+        self._models: dict[str, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, endpoint: ProviderEndpoint) -> str:
+        """Model requested from the endpoint."""
+        return endpoint.model or self.model_name
+
+    def expected_model(self) -> str:
+        """Model of the endpoint the next call will most likely be served by."""
+        return self.model_for(self.router.order(self.label)[0])
+
+    def for_endpoint(self, endpoint: ProviderEndpoint, cancel_token: Optional[CancelToken] = None) -> ChatOpenAI:
+        """ChatOpenAI for the endpoint, sending through cancel_token's abortable client if given."""
+        http_client = cancel_token.http_client(timeout=attempt_timeout()) if cancel_token else None
+        with self._lock:
+            llm = self._models.get((endpoint.name, http_client))
+            if llm is None:
+                kwargs = dict(self.kwargs)
+                kwargs["timeout"] = self.router.request_timeout(kwargs.get("timeout") or attempt_timeout())
+                kwargs["max_retries"] = self.router.client_retries()
+                llm = ChatOpenAI(
+                    api_key=self.router.api_key(endpoint, self.api_key),
+                    base_url=endpoint.base_url,
+                    model=self.model_for(endpoint),
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    http_client=http_client,
+                    **kwargs
+                )
+                self._models[(endpoint.name, http_client)] = llm
+            return llm
+
+    def invoke(self, messages: list, cancel_token: Optional[CancelToken] = None):
+        """Send messages; cancel_token (e.g. a call attempt's) overrides the model's token."""
+        cancel_token = cancel_token or self.cancel_token
+
+        def send(endpoint: ProviderEndpoint):
+            response = self.for_endpoint(endpoint, cancel_token).invoke(messages)
+            response.response_metadata[SERVED_MODEL] = self.model_for(endpoint)
+            return response
+
+        return self.router.run(send, label=self.label, cancel_token=cancel_token)
+
+    def _open_stream(
+        self,
+        endpoint: ProviderEndpoint,
+        messages: list,
+        cancel_token: Optional[CancelToken]
+    ) -> tuple[Iterator, object]:
+        chunks = self.for_endpoint(endpoint, cancel_token).stream(messages)
+        try:
+            first = next(chunks, None)
+        except BaseException:
+            chunks.close()
+            raise
+        if first is not None:
+            first.response_metadata[SERVED_MODEL] = self.model_for(endpoint)
+        return chunks, first
+
+    def stream(self, messages: list, cancel_token: Optional[CancelToken] = None) -> Iterator:
+        """Stream a response; cancel_token overrides the model's token, as in invoke."""
+        cancel_token = cancel_token or self.cancel_token
+        chunks, first = self.router.run(
+            lambda endpoint: self._open_stream(endpoint, messages, cancel_token),
+            label=self.label,
+            cancel_token=cancel_token
+        )
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            chunks.close()
+
+
+def router_from_env() -> ProviderRouter:
+    """Build the router from LLM_PROVIDERS and LLM_ROUTING."""
+    raw = os.environ.get("LLM_PROVIDERS")
+    if raw:
+        endpoints = [ProviderEndpoint(**entry) for entry in json.loads(raw)]
+    else:
+        endpoints = [ProviderEndpoint(name="openai")]
+    config = RoutingConfig(strategy=os.environ.get("LLM_ROUTING", "latency"))
+    return ProviderRouter(endpoints, config)
+
+
+_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """Return the process-wide provider router, built from the environment on first use."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = router_from_env()
+        return _router
+
+
+def set_router(router: Optional[ProviderRouter]) -> None:
+    """Replace the process-wide router (None rebuilds it from the environment)."""
+    global _router
+    with _router_lock:
+        _router = router
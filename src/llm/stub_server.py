@@ -0,0 +1,227 @@
+"""Local OpenAI-compatible stub server for tests and offline runs.
+
+Serves ``/v1/chat/completions`` (plain and streamed) with deterministic
+answers shaped like the agent pipeline expects: a JSON plan for planner
+prompts, an approving JSON review for reviewer prompts and a short story
+otherwise. Latency, streaming speed and a failure rate can be set to
+exercise hedging, routing and failover:
+
+    python -m src.llm.stub_server --port 8001 --latency 0.5 --fail-rate 0.1
+    LLM_PROVIDERS='[{"name": "stub", "base_url": "http://127.0.0.1:8001/v1"}]' streamlit run app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class StubConfig(BaseModel):
+    """Behaviour of the stub server."""
+    latency: float = Field(default=0.0, description="Seconds before the first byte of a response")
+    word_delay: float = Field(default=0.0, description="Seconds between streamed words")
+    fail_rate: float = Field(default=0.0, description="Fraction of requests answered with HTTP 500")
+    model: str = Field(default="stub-model", description="Model name reported in responses")
+
+
+def _field(prompt: str, name: str, default: str) -> str:
+    match = re.search(rf"{name}:\s*(.+)", prompt)
+    return match.group(1).strip() if match else default
+
+
+def _story(prompt: str) -> str:
+    moral = _field(prompt, "Moral", "kindness")
+    culture = _field(prompt, "Cultural Context", "Indian")
+    paragraphs = [
+        f"Once upon a time, in a quiet {culture} village, a little rabbit named Chiku lived under a mango tree.",
+        "Every morning Chiku hopped to the river, sniffed the cool grass and listened to the birds sing.",
+        "One day a small sparrow could not find her way home, and she sat on a stone, tired and sad.",
+        "Chiku remembered what Grandma Rabbit always said, and he sat beside the sparrow to keep her company.",
+        "Together they followed the river, step by step and hop by hop, until they saw the old banyan tree.",
+        "The sparrow's family chirped with joy, and the whole tree seemed to glow in the evening light.",
+        f"That night, as the moon rose, Chiku curled up and smiled, for he had learned about {moral.lower()}.",
+        "And the river whispered softly, hush, hush, sleep now, little one. The end.",
+    ]
+    return "\n\n".join(paragraphs)
+
+
+def reply_for(messages: list[dict]) -> str:
+    """Deterministic answer to a chat request, shaped after the pipeline's prompts."""
+    prompt = str(messages[-1].get("content", "")) if messages else ""
+    if '"approved"' in prompt:
+        return json.dumps({
+            "approved": True,
+            "age_appropriate": True,
+            "moral_clarity": True,
+            "length_ok": True,
+            "feedback": "Lovely, gentle story with a clear moral.",
+        })
+    if "main_characters" in prompt:
+        return json.dumps({
+            "title": "Chiku and the Lost Sparrow",
+            "main_characters": ["Chiku, a kind little rabbit", "A small lost sparrow"],
+            "setting_description": f"A quiet {_field(prompt, 'Cultural Context', 'Indian')} village by a river",
+            "plot_outline": "Chiku finds a lost sparrow, helps her home, and learns a lesson.",
+            "moral_integration": f"Helping the sparrow shows {_field(prompt, 'Moral', 'kindness').lower()}.",
+        })
+    if "---" in prompt:
+        # Enhancer: return the story it was given
+        parts = prompt.split("---")
+        if len(parts) >= 3:
+            return parts[1].strip()
+    return _story(prompt)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubServer"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.config.model, "object": "model"}]})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        config = self.server.config
+        self.server.count_request()
+        time.sleep(config.latency)
+        if random.random() < config.fail_rate:
+            self._send_json(500, {"error": {"message": "Stub failure", "type": "server_error"}})
+            return
+
+        text = reply_for(request.get("messages", []))
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(text.split()),
+            "total_tokens": prompt_tokens + len(text.split()),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        try:
+            if request.get("stream"):
+                self._stream(completion_id, text, usage, request)
+            else:
+                self._send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": config.model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, e.g. a cut-off or cancelled stream
+            pass
+
+    def _stream(self, completion_id: str, text: str, usage: dict, request: dict) -> None:
+        config = self.server.config
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices: list, **extra) -> bytes:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": config.model,
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        for word in re.findall(r"\S+\s*", text):
+            self._send_chunk(event([{"index": 0, "delta": {"content": word}, "finish_reason": None}]))
+            if config.word_delay:
+                time.sleep(config.word_delay)
+        self._send_chunk(event([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_chunk(event([], usage=usage))
+        self._send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class StubServer(ThreadingHTTPServer):
+    """The stub HTTP server; serve_in_background() runs it on a daemon thread."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: Optional[StubConfig] = None):
+        super().__init__((host, port), _Handler)
+        self.config = config or StubConfig()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def serve_in_background(self) -> "StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True, name="llm-stub-server").start()
+        return self
+
+
+def start_stub_server(port: int = 0, config: Optional[StubConfig] = None) -> StubServer:
+    """Start a stub server on localhost (a free port by default); call shutdown() to stop it."""
+    return StubServer(port=port, config=config).serve_in_background()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--word-delay", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = StubConfig(latency=args.latency, word_delay=args.word_delay, fail_rate=args.fail_rate)
+    server = StubServer(args.host, args.port, config)
+    print(f"Stub server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
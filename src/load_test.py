@@ -0,0 +1,141 @@
+"""Replay recorded story traffic against the app's generation path.
+
+Arrival times and parameters come from a jobs database (see src/jobs.py).
+Combined with LLM_CASSETTE_MODE=replay this load-tests the whole pipeline
+offline at production-like concurrency:
+
+    LLM_CASSETTE_MODE=replay python -m src.load_test --jobs-db prod_jobs.sqlite3 --concurrency 20
+
+With --stub the requests go to the bundled OpenAI-compatible stub server
+(src/llm/stub_server.py) instead, which exercises the real HTTP path.
+
+The stories, review and length stats a run produces go to a temporary data
+directory (or --data-dir), never into the app's STORY_DATA_DIR.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.agents.state import StoryParameters
+from src.storage import set_data_dir
+
+
+def load_traffic(jobs_db: str, limit: int | None = None) -> list[tuple[float, StoryParameters, bool]]:
+    """Return (offset_seconds, parameters, use_agents) for recorded jobs in arrival order.
+
+    Session prefetches and jobs cancelled before any worker claimed them
+    were never user requests, so they are left out.
+    """
+    conn = sqlite3.connect(jobs_db)
+    try:
+        query = (
+            "SELECT created_at, parameters, use_agents FROM jobs "
+            "WHERE prefetch = 0 AND NOT (status = 'cancelled' AND attempt = 0) "
+            "ORDER BY created_at"
+        )
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        rows = conn.execute(query).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return []
+    start = rows[0][0]
+    return [
+        (created_at - start, StoryParameters(**json.loads(parameters)), bool(use_agents))
+        for created_at, parameters, use_agents in rows
+    ]
+
+
+def replay_traffic(
+    traffic: list[tuple[float, StoryParameters, bool]],
+    concurrency: int = 10,
+    speedup: float = 1.0
+) -> dict:
+    """
+    Issue the recorded requests at their original (or sped-up) arrival times.
+
+    Args:
+        traffic: Output of load_traffic
+        concurrency: Maximum number of generations in flight
+        speedup: Arrival-time compression factor (2.0 = twice as fast)
+
+    Returns:
+        Latency percentiles and success counts
+    """
+    from src.gpt_commands import generate_story
+
+    def run_one(params: StoryParameters, use_agents: bool) -> tuple[float, bool]:
+        started = time.monotonic()
+        story = generate_story(
+            params.language, params.setting, params.moral, params.culture,
+            use_agents=use_agents
+        )
+        return time.monotonic() - started, bool(story)
+
+    began = time.monotonic()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, params, use_agents in traffic:
+            delay = offset / speedup - (time.monotonic() - began)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(run_one, params, use_agents))
+        results = [f.result() for f in futures]
+
+    latencies = sorted(latency for latency, _ in results)
+    if not latencies:
+        return {"requests": 0}
+    # Inclusive: percentiles stay within the observed latencies
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(results),
+        "succeeded": sum(1 for _, ok in results if ok),
+        "wall_seconds": round(time.monotonic() - began, 2),
+        "p50": round(quantiles[49], 3),
+        "p95": round(quantiles[94], 3),
+        "p99": round(quantiles[98], 3),
+        "max": round(latencies[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded story traffic")
+    parser.add_argument("--jobs-db", required=True, help="SQLite jobs database to take traffic from")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--speedup", type=float, default=1.0)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--stub", action="store_true", help="Send requests to a local stub server")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Stub seconds before each response")
+    parser.add_argument("--data-dir", default=None, help="Data directory for the run (default: a temporary one)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # The cassette is already open; everything else the run writes stays out of the app's data
+    set_data_dir(args.data_dir or tempfile.mkdtemp(prefix="story-load-test-"))
+    if args.stub:
+        from src.llm.stub_server import StubConfig, start_stub_server
+        stub = start_stub_server(config=StubConfig(latency=args.stub_latency))
+        os.environ["LLM_PROVIDERS"] = json.dumps([{"name": "stub", "base_url": stub.base_url}])
+    traffic = load_traffic(args.jobs_db, limit=args.limit)
+    report = replay_traffic(traffic, concurrency=args.concurrency, speedup=args.speedup)
+
+    from src.llm import get_breaker, get_cancellation_stats, get_cassette, get_hedger, get_router
+    report["hedging"] = get_hedger().metrics()
+    report["breaker"] = get_breaker().metrics()
+    report["cassette"] = get_cassette().metrics()
+    report["cancellation"] = get_cancellation_stats().metrics()
+    report["providers"] = get_router().metrics()
+    from src.agents.review_policy import get_review_policy
+    report["review_policy"] = get_review_policy().metrics()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
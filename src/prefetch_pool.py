@@ -0,0 +1,154 @@
+"""Pool of fresh, never-served stories for the most requested parameter combinations."""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from pydantic import BaseModel, Field
+
+from src.dedup import NearDuplicateIndex
+from src.story_cache import ParamsKey, StoryCache
+
+
+class PrefetchConfig(BaseModel):
+    """Tuning knobs for the prefetch pool."""
+    enabled: bool = Field(default=True, description="Whether the background refill thread runs")
+    hot_keys: int = Field(default=10, description="Number of most requested combinations to keep stocked")
+    min_requests: int = Field(default=3, description="Requests before a combination counts as hot")
+    stories_per_key: int = Field(default=2, description="Fresh stories kept per hot combination")
+    max_age_seconds: float = Field(default=6 * 3600, description="Pooled stories older than this are dropped")
+    idle_seconds: float = Field(default=20.0, description="Quiet time required before refilling")
+    check_interval: float = Field(default=10.0, description="Seconds between refill checks")
+
+
+class PrefetchPool:
+    """Keeps a few ready-to-serve stories for hot parameter combinations.
+
+    Popularity comes from the story cache's request counts. Serving pops a
+    story (O(1)), so each pooled story is served at most once, and wakes the
+    refill thread. Refills run one at a time and only while no user request
+    has arrived for idle_seconds, so they never compete with live traffic.
+    Refills that are near-duplicates of pooled or already served stories
+    (served_index) are dropped.
+    """
+
+    def __init__(
+        self,
+        cache: StoryCache,
+        generate: Callable[[ParamsKey], Optional[str]],
+        is_healthy: Callable[[], bool] = lambda: True,
+        served_index: Optional[NearDuplicateIndex] = None,
+        config: Optional[PrefetchConfig] = None
+    ):
+        self.cache = cache
+        self.generate = generate
+        self.is_healthy = is_healthy
+        self.served_index = served_index
+        self.config = config or PrefetchConfig()
+        self._index = NearDuplicateIndex()
+        self._lock = threading.Lock()
+        self._stories: dict[ParamsKey, deque] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._served = 0
+        self._misses = 0
+        self._generated = 0
+        self._duplicates = 0
+
+    def start(self) -> "PrefetchPool":
+        """Start the background refill thread (idempotent)."""
+        with self._lock:
+            if self.config.enabled and self._thread is None:
+                self._thread = threading.Thread(target=self._refill_loop, daemon=True, name="prefetch-pool")
+                self._thread.start()
+        return self
+
+    def take(self, key: ParamsKey) -> Optional[str]:
+        """Pop a fresh story for the key, or None if the pool has none."""
+        now = time.time()
+        with self._lock:
+            stories = self._stories.get(key)
+            while stories:
+                created_at, doc_id, story = stories.popleft()
+                self._index.remove(key, doc_id)
+                if now - created_at <= self.config.max_age_seconds:
+                    self._served += 1
+                    self._wakeup.set()
+                    return story
+            self._misses += 1
+        self._wakeup.set()
+        return None
+
+    def add(self, key: ParamsKey, story: str) -> bool:
+        """Put a never-served story into the pool; returns False for near-duplicates."""
+        if self.served_index is not None and self.served_index.is_duplicate(key, story):
+            doc_id = None
+        else:
+            doc_id = self._index.add_if_new(key, story)
+        with self._lock:
+            if doc_id is None:
+                self._duplicates += 1
+                return False
+            stories = self._stories.setdefault(key, deque())
+            stories.append((time.time(), doc_id, story))
+            while len(stories) > self.config.stories_per_key:
+                _, old_id, _ = stories.popleft()
+                self._index.remove(key, old_id)
+        return True
+
+    def hot_keys(self) -> list[ParamsKey]:
+        """Most requested combinations, hottest first."""
+        counts = self.cache.request_counts()
+        ranked = sorted(
+            (key for key, count in counts.items() if count >= self.config.min_requests),
+            key=lambda key: counts[key],
+            reverse=True
+        )
+        return ranked[:self.config.hot_keys]
+
+    def _next_key_to_fill(self) -> Optional[ParamsKey]:
+        now = time.time()
+        with self._lock:
+            for key in self.hot_keys():
+                stories = self._stories.get(key, deque())
+                while stories and now - stories[0][0] > self.config.max_age_seconds:
+                    _, old_id, _ = stories.popleft()
+                    self._index.remove(key, old_id)
+                if len(stories) < self.config.stories_per_key:
+                    return key
+        return None
+
+    def _refill_loop(self) -> None:
+        while True:
+            self._wakeup.wait(self.config.check_interval)
+            self._wakeup.clear()
+            # Only use idle capacity: wait until live traffic has been quiet for a while
+            if self.cache.seconds_since_last_request() < self.config.idle_seconds:
+                continue
+            if not self.is_healthy():
+                continue
+            key = self._next_key_to_fill()
+            if key is None:
+                continue
+            try:
+                story = self.generate(key)
+            except Exception as e:
+                logging.error(f"Error refilling prefetch pool: {str(e)}")
+                continue
+            if story:
+                with self._lock:
+                    self._generated += 1
+                self.add(key, story)
+                # More keys may still be short, check again right away
+                self._wakeup.set()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "pooled": sum(len(stories) for stories in self._stories.values()),
+                "served": self._served,
+                "misses": self._misses,
+                "generated": self._generated,
+                "duplicates_dropped": self._duplicates,
+            }
@@ -0,0 +1,318 @@
+"""Opt-in per-request sampling profiler with speedscope output.
+
+Enable with STORY_PROFILE=1, or per session with the sidebar switch (the
+choice travels with the job). Each profiled request writes
+``.story_data/profiles/<time>-<name>.speedscope.json`` (open it at
+https://www.speedscope.app) and logs a table of the top local CPU hotspots.
+
+Samples come from the thread that runs the request plus the LLM call
+threads while they work for it (see carry_profile). Every sample is
+classified as CPU, network wait (blocked in socket/SSL/HTTP client code)
+or other wait (locks, futures, sleeps), and the three are kept as separate
+profiles so HTTP latency does not drown out local hotspots.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, TypeVar
+
+from src.storage import data_path
+
+T = TypeVar("T")
+
+SAMPLE_INTERVAL = 0.005
+
+# Modules whose frames mean a thread is doing or waiting on network I/O;
+# prefixes also match forks such as httpx2 / httpcore2
+_NETWORK_STDLIB_MODULES = {"socket", "ssl", "selectors", "http.client"}
+_NETWORK_PACKAGE_PREFIXES = ("httpx", "httpcore", "h11", "h2", "urllib3", "anyio")
+# Used to spot waiting threads when the OS thread state is unavailable
+_WAIT_FUNCTIONS = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("threading.py", "join"), ("queue.py", "get"), ("_base.py", "wait"),
+    ("_base.py", "result"), ("thread.py", "_worker"),
+}
+
+# Thread ident -> profiler sampling it, for threads working for a profiled request
+_thread_profilers: dict[int, "SamplingProfiler"] = {}
+_registry_lock = threading.Lock()
+
+
+def profiling_enabled() -> bool:
+    """Process default from STORY_PROFILE; requests may override it."""
+    return os.environ.get("STORY_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+def carry_profile(call: Callable[..., T]) -> Callable[..., T]:
+    """Wrap call so the (pool) thread running it is sampled by the caller's profiler.
+
+    Returns call unchanged when the calling thread is not being profiled.
+    """
+    with _registry_lock:
+        profiler = _thread_profilers.get(threading.get_ident())
+    if profiler is None:
+        return call
+
+    def run(*args, **kwargs) -> T:
+        ident = threading.get_ident()
+        profiler.add_thread(ident, threading.get_native_id())
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profiler.remove_thread(ident)
+
+    return run
+
+
+def _package_of(filename: str) -> str:
+    """Coarse owner of a source file: a third-party package, the app, or stdlib."""
+    normalized = filename.replace("\\", "/")
+    if "site-packages/" in normalized:
+        return normalized.split("site-packages/", 1)[1].split("/", 1)[0].removesuffix(".py")
+    if "/src/" in normalized or normalized.endswith("app.py"):
+        return "app"
+    return "stdlib"
+
+
+def _thread_cpu_state(native_id: Optional[int]) -> Optional[tuple[bool, int]]:
+    """(on CPU now, CPU ticks used so far) for an OS thread; None off Linux."""
+    if native_id is None:
+        return None
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the parenthesised thread name: state is first, utime/stime 12th/13th
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return fields[0] == b"R", int(fields[11]) + int(fields[12])
+
+
+def _is_network_module(module: str) -> bool:
+    return module in _NETWORK_STDLIB_MODULES or module.split(".", 1)[0].startswith(_NETWORK_PACKAGE_PREFIXES)
+
+
+def _in_network_code(stack: list) -> bool:
+    return any(_is_network_module(frame.f_globals.get("__name__", "")) for frame in stack[-8:])
+
+
+def _classify(stack: list, running: Optional[bool]) -> str:
+    """cpu, network or wait for one sampled stack."""
+    if running is None:
+        # No OS thread state: guess from the innermost frame. Blocking C calls
+        # (sleep, recv) look like CPU in their Python caller here.
+        leaf = stack[-1].f_code
+        if _in_network_code(stack[-3:]):
+            return "network"
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in _WAIT_FUNCTIONS:
+            return "wait"
+        return "cpu"
+    if running:
+        return "cpu"
+    return "network" if _in_network_code(stack) else "wait"
+
+
+class SamplingProfiler:
+    """Samples the stacks of one thread, and the threads it hands work to, at a fixed interval."""
+
+    def __init__(self, name: str, interval: float = SAMPLE_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.target_ident = threading.get_ident()
+        self._threads: dict[int, Optional[int]] = {self.target_ident: threading.get_native_id()}
+        self._threads_lock = threading.Lock()
+        self._frames: dict[tuple[str, str, int], int] = {}
+        self._samples: dict[str, list[list[int]]] = {"cpu": [], "network": [], "wait": []}
+        # Seconds each sample stands for; passes get delayed while busy threads hold the GIL
+        self._weights: dict[str, list[float]] = {"cpu": [], "network": [], "wait": []}
+        self._cpu_ticks: dict[int, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="story-profiler")
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        with _registry_lock:
+            _thread_profilers[self.target_ident] = self
+        self._thread.start()
+
+    def stop(self) -> None:
+        with _registry_lock:
+            if _thread_profilers.get(self.target_ident) is self:
+                del _thread_profilers[self.target_ident]
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def add_thread(self, ident: int, native_id: Optional[int]) -> None:
+        """Sample another thread while it works for this request."""
+        with self._threads_lock:
+            self._threads[ident] = native_id
+        with _registry_lock:
+            _thread_profilers[ident] = self
+
+    def remove_thread(self, ident: int) -> None:
+        with self._threads_lock:
+            self._threads.pop(ident, None)
+        with _registry_lock:
+            if _thread_profilers.get(ident) is self:
+                del _thread_profilers[ident]
+
+    def _frame_id(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        frame_id = self._frames.get(key)
+        if frame_id is None:
+            frame_id = self._frames[key] = len(self._frames)
+        return frame_id
+
+    def _sampled_threads(self) -> dict[int, Optional[int]]:
+        """Python thread ident -> OS thread id of the threads to sample."""
+        with self._threads_lock:
+            return dict(self._threads)
+
+    def _is_running(self, ident: int, native_id: Optional[int]) -> Optional[bool]:
+        state = _thread_cpu_state(native_id)
+        if state is None:
+            return None
+        on_cpu, ticks = state
+        # A busy thread waiting for the GIL while we sample shows as sleeping,
+        # so CPU time used since the previous sample also counts as running
+        used_cpu = ticks > self._cpu_ticks.get(ident, ticks)
+        self._cpu_ticks[ident] = ticks
+        return on_cpu or used_cpu
+
+    def _run(self) -> None:
+        last_pass = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last_pass = now - last_pass, now
+            threads = self._sampled_threads()
+            for ident, frame in sys._current_frames().items():
+                if ident not in threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame)
+                    frame = frame.f_back
+                stack.reverse()
+                if not stack:
+                    continue
+                category = _classify(stack, self._is_running(ident, threads[ident]))
+                # Idle pool threads are not part of the request
+                if category == "wait" and ident != self.target_ident:
+                    continue
+                self._samples[category].append([self._frame_id(f) for f in stack])
+                self._weights[category].append(weight)
+
+    def to_speedscope(self) -> dict:
+        """Speedscope file with one sampled profile per category."""
+        frames = [None] * len(self._frames)
+        for (name, filename, line), frame_id in self._frames.items():
+            frames[frame_id] = {"name": name, "file": filename, "line": line}
+        profiles = []
+        for category, samples in self._samples.items():
+            weights = self._weights[category]
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.name} ({category})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "bedtime-stories-profiler",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def summary(self, top: int = 15) -> str:
+        """Markdown table of time split and the top local CPU hotspots."""
+        frames = {frame_id: key for key, frame_id in self._frames.items()}
+        totals = {category: sum(weights) for category, weights in self._weights.items()}
+        all_seconds = sum(totals.values()) or 1.0
+        cpu_seconds = totals["cpu"] or 1.0
+
+        self_time: Counter = Counter()
+        by_package: Counter = Counter()
+        for stack, weight in zip(self._samples["cpu"], self._weights["cpu"]):
+            name, filename, line = frames[stack[-1]]
+            self_time[f"{name} ({os.path.basename(filename)}:{line})"] += weight
+            # Attribute to the innermost frame that is not stdlib glue
+            owner = "stdlib"
+            for frame_id in reversed(stack):
+                owner = _package_of(frames[frame_id][1])
+                if owner != "stdlib":
+                    break
+            by_package[owner] += weight
+
+        lines = [
+            f"### Profile: {self.name} ({self.duration:.2f}s wall)",
+            "",
+            "| category | seconds | share |",
+            "|---|---|---|",
+        ]
+        for category in ("cpu", "network", "wait"):
+            lines.append(f"| {category} | {totals[category]:.3f} | {totals[category] / all_seconds:.0%} |")
+        lines += ["", "| package (cpu) | seconds | share of cpu |", "|---|---|---|"]
+        for package, seconds in by_package.most_common(10):
+            lines.append(f"| {package} | {seconds:.3f} | {seconds / cpu_seconds:.0%} |")
+        lines += ["", "| hotspot (self cpu) | seconds | share of cpu |", "|---|---|---|"]
+        for function, seconds in self_time.most_common(top):
+            lines.append(f"| {function} | {seconds:.3f} | {seconds / cpu_seconds:.0%} |")
+        return "\n".join(lines)
+
+
+class ProfileResult:
+    """Where a finished profile was written, and its summary."""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.summary: Optional[str] = None
+
+
+@contextmanager
+def profile_request(name: str, enabled: Optional[bool] = None) -> Iterator[ProfileResult]:
+    """
+    Profile the enclosed block if profiling is enabled.
+
+    Args:
+        name: Label used in the output file name and report
+        enabled: Profile this request or not (e.g. a session's choice);
+            None defers to profiling_enabled()
+
+    Yields:
+        A ProfileResult, filled in when the block exits
+    """
+    result = ProfileResult()
+    if not (profiling_enabled() if enabled is None else enabled):
+        yield result
+        return
+
+    profiler = SamplingProfiler(name)
+    profiler.start()
+    try:
+        yield result
+    finally:
+        profiler.stop()
+        try:
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            path = data_path("profiles") / f"{stamp}-{name}-{profiler.target_ident}.speedscope.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(profiler.to_speedscope(), f)
+            result.path = str(path)
+            result.summary = profiler.summary()
+            logging.info(f"Wrote profile to {path}\n{result.summary}")
+        except Exception as e:
+            logging.error(f"Error writing profile: {str(e)}")
@@ -0,0 +1,17 @@
+"""Location of local data files (job queue, stats, story library)."""
+import os
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get("STORY_DATA_DIR", ".story_data"))
+
+
+def set_data_dir(path: str) -> None:
+    """Point data files created from now on at another directory (e.g. for load tests)."""
+    global DATA_DIR
+    DATA_DIR = Path(path)
+
+
+def data_path(filename: str) -> Path:
+    """Return the path of a data file, creating the data directory if needed."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR / filename
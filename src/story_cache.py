@@ -0,0 +1,84 @@
+"""In-memory cache of recently generated stories, keyed by story parameters."""
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Optional
+
+from src.dedup import NearDuplicateIndex
+
+ParamsKey = tuple[str, str, str, str]
+
+
+def params_key(language: str, setting: str, moral: str, culture: str) -> ParamsKey:
+    """Build the cache key for a parameter combination."""
+    return (language, setting, moral, culture)
+
+
+class StoryCache:
+    """Keeps the last few stories for each parameter combination.
+
+    Used as an instant fallback when the provider is unhealthy. Also counts
+    requests per combination so callers can see which ones are popular.
+    Near-duplicates of stories already cached for a key are not stored.
+    """
+
+    def __init__(self, max_keys: int = 500, stories_per_key: int = 5):
+        self.max_keys = max_keys
+        self.stories_per_key = stories_per_key
+        self._lock = threading.Lock()
+        self._stories: OrderedDict[ParamsKey, deque] = OrderedDict()
+        self._index = NearDuplicateIndex()
+        self._requests: Counter = Counter()
+        self._last_request_at = 0.0
+
+    def put(self, key: ParamsKey, story: str) -> bool:
+        """Store a generated story; returns False if it was a near-duplicate."""
+        doc_id = self._index.add_if_new(key, story)
+        if doc_id is None:
+            return False
+        with self._lock:
+            stories = self._stories.get(key)
+            if stories is None:
+                stories = deque()
+                self._stories[key] = stories
+            stories.append((doc_id, story))
+            while len(stories) > self.stories_per_key:
+                old_id, _ = stories.popleft()
+                self._index.remove(key, old_id)
+            self._stories.move_to_end(key)
+            while len(self._stories) > self.max_keys:
+                old_key, old_stories = self._stories.popitem(last=False)
+                for old_id, _ in old_stories:
+                    self._index.remove(old_key, old_id)
+        return True
+
+    def get(self, key: ParamsKey) -> Optional[str]:
+        """Return a random cached story for the key, or None."""
+        with self._lock:
+            stories = self._stories.get(key)
+            if not stories:
+                return None
+            self._stories.move_to_end(key)
+            return random.choice(stories)[1]
+
+    def record_request(self, key: ParamsKey) -> None:
+        """Count a request for the key."""
+        with self._lock:
+            self._requests[key] += 1
+            self._last_request_at = time.monotonic()
+
+    def seconds_since_last_request(self) -> float:
+        """Time since any request was recorded (infinite if none yet)."""
+        with self._lock:
+            if not self._last_request_at:
+                return float("inf")
+            return time.monotonic() - self._last_request_at
+
+    def request_counts(self) -> dict[ParamsKey, int]:
+        """Return request counts per key."""
+        with self._lock:
+            return dict(self._requests)
+
+
+story_cache = StoryCache()
@@ -0,0 +1,178 @@
+"""Session-scoped story store so generated stories survive Streamlit reruns."""
+import time
+from typing import Optional
+
+import streamlit as st
+from pydantic import BaseModel, Field
+
+from src.agents.state import StoryParameters, StoryPlan
+from src.jobs import Job, get_worker_pool
+from src.library import LibraryStory
+
+MAX_HISTORY = 20
+
+
+class StoryRecord(BaseModel):
+    """A finished story kept in the session history."""
+    story: str = Field(description="Final story text")
+    parameters: StoryParameters = Field(description="Parameters the story was generated with")
+    plan: Optional[StoryPlan] = Field(default=None, description="Planner output, if the agent pipeline ran")
+    created_at: float = Field(default_factory=time.time, description="Unix time the story finished")
+
+    @property
+    def title(self) -> str:
+        if self.plan:
+            return self.plan.title
+        first_line = self.story.strip().splitlines()[0] if self.story.strip() else "Untitled story"
+        return first_line.strip("# *")[:60]
+
+
+class JobProgress:
+    """Latest stage and plan of a job, built from its progress events."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.stage = "starting"
+        self.plan: Optional[StoryPlan] = None
+        self._cursor = 0
+
+    def refresh(self) -> None:
+        for event in get_worker_pool().queue.events(self.job_id, after_id=self._cursor):
+            self._cursor = event.id
+            self.stage = event.stage
+            if event.payload.get("plan"):
+                self.plan = StoryPlan(**event.payload["plan"])
+
+
+class SessionStoryStore:
+    """Current story, history, the in-flight job and one prefetched variant.
+
+    Generations run as background jobs (see src/jobs.py), so only job ids
+    are kept here and the work continues across reruns and reconnects.
+    """
+
+    def __init__(self):
+        self.current: Optional[StoryRecord] = None
+        self.history: list[StoryRecord] = []
+        self.active: Optional[JobProgress] = None
+        self.prefetch_job_id: Optional[str] = None
+        self.prefetch_key: Optional[tuple[StoryParameters, bool]] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def is_generating(self) -> bool:
+        return self.active is not None
+
+    def generate(self, parameters: StoryParameters, use_agents: bool, profile: Optional[bool] = None) -> None:
+        """Start a fresh generation for the given parameters, replacing any in flight.
+
+        profile is this session's profiling choice; it is passed on to the job.
+        """
+        self.cancel()
+        if self.prefetch_job_id and self.prefetch_key != (parameters, use_agents):
+            get_worker_pool().cancel(self.prefetch_job_id)
+            self.prefetch_job_id = None
+            self.prefetch_key = None
+        self.last_error = None
+        self.resume(get_worker_pool().submit(parameters, use_agents, profile=profile))
+
+    def cancel(self) -> None:
+        """Stop the in-flight generation, aborting its pending LLM calls."""
+        if self.active is None:
+            return
+        get_worker_pool().cancel(self.active.job_id)
+        self.active = None
+        if "job" in st.query_params:
+            del st.query_params["job"]
+
+    def resume(self, job_id: str) -> None:
+        """Follow an existing job, e.g. after the page reconnects."""
+        self.active = JobProgress(job_id)
+        st.query_params["job"] = job_id
+
+    def next_story(self, parameters: StoryParameters, use_agents: bool, profile: Optional[bool] = None) -> None:
+        """Show another variant, using the prefetched story when it matches."""
+        if self.prefetch_job_id and self.prefetch_key == (parameters, use_agents):
+            job_id = self.prefetch_job_id
+            self.prefetch_job_id = None
+            self.prefetch_key = None
+            self.last_error = None
+            self.resume(job_id)
+            self.poll()
+        else:
+            self.generate(parameters, use_agents, profile=profile)
+
+    def heartbeat(self) -> None:
+        """Tell the worker pool this session still wants its jobs.
+
+        Jobs nobody touches anymore, including the prefetch, get cancelled.
+        """
+        for job_id in (self.active.job_id if self.active else None, self.prefetch_job_id):
+            if job_id:
+                get_worker_pool().queue.touch(job_id)
+
+    def poll(self) -> None:
+        """Refresh progress and promote the in-flight job once it has finished."""
+        self.heartbeat()
+        progress = self.active
+        if progress is None:
+            return
+        job = get_worker_pool().queue.get(progress.job_id)
+        if job is None:
+            self.active = None
+            self.last_error = "Story job not found"
+            return
+        progress.refresh()
+        if not job.finished:
+            return
+        self.active = None
+        if "job" in st.query_params:
+            del st.query_params["job"]
+        if job.status != "done" or not job.story:
+            self.last_error = job.error or f"Story job {job.status}"
+            return
+        self._promote(job)
+        self._start_prefetch(job.parameters, job.use_agents, job.profile)
+
+    def _promote(self, job: Job) -> None:
+        if job.prefetch:
+            # Imported here: gpt_commands starts the prefetch pool at import time
+            from src.gpt_commands import mark_served
+            mark_served(job.parameters, job.story, plan=job.plan)
+        self.show(StoryRecord(story=job.story, parameters=job.parameters, plan=job.plan))
+
+    def _start_prefetch(self, parameters: StoryParameters, use_agents: bool, profile: Optional[bool]) -> None:
+        # Generate the next variant while the current story is being read
+        if self.prefetch_job_id and self.prefetch_key == (parameters, use_agents):
+            return
+        self.prefetch_job_id = get_worker_pool().submit(parameters, use_agents, prefetch=True, profile=profile)
+        self.prefetch_key = (parameters, use_agents)
+
+    def show(self, record: StoryRecord) -> None:
+        """Make a story (e.g. from the library) the current story."""
+        if self.current is not None:
+            self.history.insert(0, self.current)
+            del self.history[MAX_HISTORY:]
+        self.current = record
+
+    def show_library_story(self, stored: LibraryStory) -> None:
+        self.show(StoryRecord(story=stored.story, parameters=stored.parameters, plan=stored.plan))
+
+    def select(self, index: int) -> None:
+        """Swap a story from history back in as the current story."""
+        record = self.history.pop(index)
+        if self.current is not None:
+            self.history.insert(0, self.current)
+        self.current = record
+
+
+def get_story_store() -> SessionStoryStore:
+    """Return this session's story store, creating it on first use."""
+    if "story_store" not in st.session_state:
+        store = SessionStoryStore()
+        # A reconnecting page picks its in-flight job back up from the URL
+        job_id = st.query_params.get("job")
+        if job_id:
+            store.resume(job_id)
+        st.session_state["story_store"] = store
+    return st.session_state["story_store"]
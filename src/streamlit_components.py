@@ -1,48 +1,57 @@
 import streamlit as st
 import time
 
+LANGUAGES = ["English", "Hindi", "Hinglish"]
+SETTINGS = ["People", "Animals", "Both People & Animals"]
+MORALS = [
+    "Kindness", "Honesty", "Sharing", "Patience",
+    "Courage", "Friendship", "Love", "Respect",
+    "Responsibility", "Gratitude", "Empathy",
+    "Hard Work", "Consistency"
+]
+CULTURES = ["American", "British", "Indian", "French", "Spanish"]
+ANY_OPTION = "Any"
+
 def render_story_parameters():
     """Render the story parameter selection components."""
     language = st.selectbox(
         "Choose Your Story Language 🗣️",
-        ["English", "Hindi", "Hinglish"],
+        LANGUAGES,
         help="Select the language for your story"
     )
 
     setting = st.selectbox(
         "Choose the Characters of the Story 🎭",
-        ["People", "Animals", "Both People & Animals"],
+        SETTINGS,
         help="Choose who the story will be about"
     )
 
     moral = st.selectbox(
         "Choose the Life Lesson 🌟",
-        [
-            "Kindness", "Honesty", "Sharing", "Patience",
-            "Courage", "Friendship", "Love", "Respect",
-            "Responsibility", "Gratitude", "Empathy",
-            "Hard Work", "Consistency"
-        ],
+        MORALS,
         help="Select the moral lesson for your story"
     )
 
     culture = st.selectbox(
         "Choose your Culture 🌍",
-        ["American", "British", "Indian", "French", "Spanish"],
+        CULTURES,
         help="Select the cultural context for your story"
     )
 
     return language, setting, moral, culture
 
-def render_story_output(story):
+def render_story_output(story, on_new_story=None, on_new_story_args=()):
     """Render the story output and action buttons."""
     st.success("✨ Your magical story is ready!")
     st.markdown(story)
     
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("🔄 Generate New Story"):
-            st.rerun()
+        st.button(
+            "🔄 Generate New Story",
+            on_click=on_new_story,
+            args=on_new_story_args
+        )
     with col2:
         st.download_button(
             label="📥 Save Story",
@@ -51,6 +60,54 @@ def render_story_output(story):
             mime="text/plain"
         )
 
+def render_story_history(history, on_select):
+    """Render earlier stories from this session."""
+    if not history:
+        return
+    with st.expander(f"📚 Earlier stories ({len(history)})", expanded=False):
+        for index, record in enumerate(history):
+            st.button(
+                f"📖 {record.title}",
+                key=f"history_{index}_{record.created_at}",
+                on_click=on_select,
+                args=(index,)
+            )
+
+def render_library_search(search, on_select):
+    """Render the story library search box, its filters and the results.
+
+    search is called with the query and the chosen filters as keyword
+    arguments (language, setting, moral, culture).
+    """
+    query = st.text_input(
+        "Search saved stories 🔎",
+        placeholder="e.g. a puppy and sharing",
+        help="Search titles, characters and story text of earlier stories"
+    )
+    with st.expander("Filters", expanded=False):
+        choices = {
+            "language": st.selectbox("Language", [ANY_OPTION] + LANGUAGES, key="library_language"),
+            "setting": st.selectbox("Characters", [ANY_OPTION] + SETTINGS, key="library_setting"),
+            "moral": st.selectbox("Life Lesson", [ANY_OPTION] + MORALS, key="library_moral"),
+            "culture": st.selectbox("Culture", [ANY_OPTION] + CULTURES, key="library_culture"),
+        }
+    filters = {name: value for name, value in choices.items() if value != ANY_OPTION}
+    # With only filters set, the newest matching stories are listed
+    if not query and not filters:
+        return
+    results = search(query, **filters)
+    if not results:
+        st.caption("No stories found yet.")
+        return
+    for result in results:
+        st.button(
+            f"📖 {result.title}",
+            key=f"library_{result.id}",
+            help=f"{result.parameters.language} · {result.parameters.moral} · {result.parameters.culture}",
+            on_click=on_select,
+            args=(result,)
+        )
+
 def render_story_generator():
     """Render the story generator section."""
     return st.button("✨ Generate Story ✨", type="primary")
\ No newline at end of file
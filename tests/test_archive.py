@@ -0,0 +1,14 @@
+import json
+
+from src.archive import StoryArchive
+
+
+def test_small_sample_archive_round_trips(tmp_path):
+    records = [{"story": f"Once upon a time a little rabbit named Chiku {i} hopped home."} for i in range(3)]
+    samples = [json.dumps(record).encode("utf-8") for record in records]
+    archive = StoryArchive.create(str(tmp_path / "stories"), samples)
+    for record in records:
+        archive.append(record)
+
+    assert list(archive) == records
+    archive.close()
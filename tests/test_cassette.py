@@ -0,0 +1,34 @@
+import pytest
+
+from src.llm.cassette import Cassette, CassetteEntry, CassetteMissError, fingerprint
+
+
+def _cassette(tmp_path, strict: bool) -> Cassette:
+    path = str(tmp_path / "cassette.jsonl.gz")
+    Cassette(path, mode="record").record(CassetteEntry(
+        fingerprint=fingerprint({"prompt": "plan"}),
+        label="planner",
+        kind="langchain",
+        content="recorded plan",
+        latency=0.1,
+    ))
+    return Cassette(path, mode="replay", time_scale=0, strict=strict)
+
+
+def test_exact_match_is_replayed(tmp_path):
+    cassette = _cassette(tmp_path, strict=True)
+    assert cassette.lookup(fingerprint({"prompt": "plan"}), "planner").content == "recorded plan"
+
+
+def test_strict_cassette_raises_on_miss(tmp_path):
+    cassette = _cassette(tmp_path, strict=True)
+    with pytest.raises(CassetteMissError):
+        cassette.lookup(fingerprint({"prompt": "other"}), "planner")
+
+
+def test_lenient_cassette_logs_miss(tmp_path, caplog):
+    cassette = _cassette(tmp_path, strict=False)
+    entry = cassette.lookup(fingerprint({"prompt": "other"}), "planner")
+    assert entry.content == "recorded plan"
+    assert "No recorded response" in caplog.text
+    assert cassette.metrics()["replay_misses"] == 1
@@ -0,0 +1,100 @@
+import pytest
+
+from src.llm import calls, circuit_breaker
+from src.llm.cancellation import GenerationCancelled
+from src.llm.circuit_breaker import CircuitBreaker, CircuitBreakerConfig, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker, "time", fake)
+    return fake
+
+
+def _tripped(clock: FakeClock) -> CircuitBreaker:
+    breaker = CircuitBreaker(CircuitBreakerConfig(min_calls=4, error_rate_threshold=0.5, open_seconds=30))
+    for ok in (True, True, False, False):
+        assert breaker.allow_request()
+        breaker.record(ok, 1.0)
+    return breaker
+
+
+def test_trips_open_at_error_rate(clock):
+    breaker = CircuitBreaker(CircuitBreakerConfig(min_calls=4, error_rate_threshold=0.5))
+    for ok in (True, False, False):
+        breaker.record(ok, 1.0)
+    # Too few calls to judge yet
+    assert breaker.state == "closed"
+
+    breaker.record(False, 1.0)
+    assert breaker.state == "open"
+    assert not breaker.allow_request()
+    assert breaker.metrics()["rejected"] == 1
+
+
+def test_trips_open_on_slow_calls(clock):
+    breaker = CircuitBreaker(CircuitBreakerConfig(min_calls=4, slow_call_seconds=10, slow_rate_threshold=0.75))
+    for latency in (1.0, 20.0, 20.0, 20.0):
+        breaker.record(True, latency)
+    assert breaker.state == "open"
+
+
+def test_half_open_admits_limited_probes(clock):
+    breaker = _tripped(clock)
+    clock.now += 29
+    assert breaker.is_open()
+
+    clock.now += 1
+    assert breaker.state == "half_open"
+    assert not breaker.is_open()
+    assert breaker.allow_request()
+    # The single probe slot is taken
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_and_failed_probe_reopens(clock):
+    breaker = _tripped(clock)
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record(False, 1.0)
+    assert breaker.state == "open"
+    assert breaker.metrics()["times_opened"] == 2
+
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record(True, 1.0)
+    assert breaker.state == "closed"
+    assert breaker.metrics()["window_calls"] == 0
+
+
+def test_cancelled_probe_releases_its_slot(clock, monkeypatch):
+    breaker = _tripped(clock)
+    monkeypatch.setattr(calls, "_breaker", breaker)
+    clock.now += 30
+
+    def cancelled_send(token):
+        raise GenerationCancelled("session left")
+
+    with pytest.raises(GenerationCancelled):
+        calls.call_llm(cancelled_send, label="writer")
+    # The cancelled probe says nothing about the provider: still half-open, slot free
+    assert breaker.state == "half_open"
+    assert calls.call_llm(lambda token: "story", label="writer") == "story"
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_rejects_call_llm(clock, monkeypatch):
+    monkeypatch.setattr(calls, "_breaker", _tripped(clock))
+    with pytest.raises(CircuitOpenError):
+        calls.call_llm(lambda token: "story", label="writer")
+    assert calls.call_llm(lambda token: "story", label="writer", bypass_breaker=True) == "story"
@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.llm.cancellation import CancelToken, GenerationCancelled
+from src.llm.hedging import HedgedExecutor, HedgingConfig
+
+
+def _hedger(**config) -> HedgedExecutor:
+    return HedgedExecutor(HedgingConfig(**{"initial_delay": 0.05, "min_delay": 0.01, **config}))
+
+
+def test_concurrent_calls_do_not_queue_for_threads():
+    hedger = _hedger(initial_delay=5.0)
+
+    def call(token: CancelToken) -> str:
+        token.wait(0.3)
+        return "ok"
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        results = list(pool.map(lambda _: hedger.run(call, label="simple"), range(40)))
+    assert results == ["ok"] * 40
+    assert time.monotonic() - started < 1.5
+
+
+def test_losing_attempt_is_aborted():
+    hedger = _hedger()
+    tokens: list[CancelToken] = []
+    loser_aborted = threading.Event()
+
+    def call(token: CancelToken) -> str:
+        tokens.append(token)
+        if len(tokens) == 1:
+            if token.wait(5.0):
+                loser_aborted.set()
+                raise GenerationCancelled(token.reason)
+            return "primary"
+        return "hedge"
+
+    assert hedger.run(call, label="writer") == "hedge"
+    assert loser_aborted.wait(1.0)
+    metrics = hedger.metrics()
+    assert metrics["hedge_wins"] == 1
+    assert metrics["attempts_aborted"] == 1
+
+
+def test_timeout_aborts_pending_attempts():
+    hedger = _hedger(enabled=True, burst=0, max_extra_ratio=0.0)
+    tokens: list[CancelToken] = []
+
+    def call(token: CancelToken) -> str:
+        tokens.append(token)
+        token.wait(5.0)
+        return "late"
+
+    with pytest.raises(TimeoutError):
+        hedger.run(call, label="writer", timeout=0.1)
+    assert len(tokens) == 1 and tokens[0].cancelled
+
+
+def test_cancelling_the_generation_cancels_its_attempts():
+    hedger = _hedger(initial_delay=5.0)
+    generation = CancelToken()
+    tokens: list[CancelToken] = []
+
+    def call(token: CancelToken) -> str:
+        tokens.append(token)
+        token.wait(5.0)
+        token.raise_if_cancelled()
+        return "late"
+
+    threading.Timer(0.1, generation.cancel).start()
+    with pytest.raises(GenerationCancelled):
+        hedger.run(call, label="writer", cancel_token=generation)
+    assert tokens[0].cancelled
+
+
+def test_http_clients_are_reused_unless_aborted():
+    first = CancelToken().child()
+    client = first.http_client()
+    first.close()
+    second = CancelToken()
+    assert second.http_client() is client
+
+    second.cancel()
+    second.close()
+    assert CancelToken().http_client() is not client
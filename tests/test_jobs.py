@@ -0,0 +1,95 @@
+import sqlite3
+import threading
+import time
+
+from src import gpt_commands, jobs
+from src.agents.state import StoryParameters
+from src.jobs import JobQueue, JobWorkerPool
+
+PARAMS = StoryParameters(language="English", setting="Animals", moral="Kindness", culture="Indian")
+
+
+def _set_updated_at(queue: JobQueue, job_id: str, updated_at: float) -> None:
+    with queue._connect() as conn:
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (updated_at, job_id))
+
+
+def test_purge_removes_old_finished_jobs_and_events(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    old_done, recent_done, old_queued = (queue.submit(PARAMS, use_agents=False) for _ in range(3))
+    for job_id in (old_done, recent_done):
+        job = queue.claim_next("test")
+        queue.add_event(job.id, "writer", {"draft": "Once upon a time"})
+        queue.complete(job.id, job.attempt, "The end.", None)
+    _set_updated_at(queue, old_done, time.time() - 3600)
+    _set_updated_at(queue, old_queued, time.time() - 3600)
+
+    assert queue.purge_finished(max_age=60) == 1
+
+    assert queue.get(old_done) is None
+    assert queue.events(old_done) == []
+    assert queue.get(recent_done).status == "done"
+    assert queue.get(old_queued).status == "queued"
+
+
+def test_worker_survives_database_errors_while_failing_a_job(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    calls = []
+    second_call = threading.Event()
+
+    def broken_generate(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            second_call.set()
+        raise RuntimeError("provider down")
+
+    def locked_fail(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(gpt_commands, "generate_story", broken_generate)
+    monkeypatch.setattr(queue, "fail", locked_fail)
+    pool = JobWorkerPool(queue, max_workers=1, poll_interval=0.05)
+    try:
+        pool.submit(PARAMS, use_agents=False)
+        pool.submit(PARAMS, use_agents=False)
+        assert second_call.wait(5)
+    finally:
+        pool.stop()
+
+
+def test_interactive_jobs_are_claimed_before_prefetch(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    prefetch = queue.submit(PARAMS, prefetch=True)
+    interactive = queue.submit(PARAMS)
+
+    assert queue.claim_next("a").id == interactive
+    assert queue.claim_next("a", include_prefetch=False) is None
+    assert queue.claim_next("a").id == prefetch
+
+
+def test_expired_lease_is_requeued_and_the_stale_attempt_loses(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.submit(PARAMS)
+    stale = queue.claim_next("a")
+    assert stale.attempt == 1
+
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.0)
+    retried = queue.claim_next("b")
+    assert retried.id == job_id and retried.attempt == 2
+
+    assert not queue.complete(job_id, stale.attempt, "Stale story.", None)
+    assert not queue.fail(job_id, stale.attempt, "stale worker gave up")
+    assert queue.complete(job_id, retried.attempt, "Fresh story.", None)
+    assert queue.get(job_id).story == "Fresh story."
+
+
+def test_only_watched_idle_jobs_are_abandoned(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    watched, unwatched, prefetch = queue.submit(PARAMS), queue.submit(PARAMS), queue.submit(PARAMS, prefetch=True)
+    queue.touch(watched)
+
+    assert queue.cancel_abandoned(max_idle=60) == []
+    abandoned = {job.id for job in queue.cancel_abandoned(max_idle=0)}
+
+    assert abandoned == {watched, prefetch}
+    assert queue.get(unwatched).status == "queued"
@@ -0,0 +1,29 @@
+from langchain_core.messages import AIMessageChunk
+
+from src import storage
+from src.agents.nodes import _describe_request, stream_llm
+from src.llm.length_control import get_length_controller
+
+
+class FakeLLM:
+    model_name = "gpt-5-mini"
+    temperature = 0.7
+
+    def __init__(self, max_tokens: int = 600):
+        self.max_tokens = max_tokens
+
+    def stream(self, messages, cancel_token=None):
+        for _ in range(300):
+            yield AIMessageChunk(content="One more sleepy sentence. ")
+
+
+def test_cut_off_output_is_trimmed_to_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DATA_DIR", tmp_path)
+    response = stream_llm(FakeLLM(), [], label="writer", language="English")
+    assert response.response_metadata["cut_off"]
+    assert len(response.content.split()) <= get_length_controller().word_budget("writer")
+    assert response.content.endswith(".")
+
+
+def test_fingerprint_ignores_learned_max_tokens():
+    assert _describe_request(FakeLLM(600), []) == _describe_request(FakeLLM(900), [])
@@ -0,0 +1,21 @@
+from src.agents.state import StoryParameters
+from src.jobs import JobQueue
+from src.load_test import load_traffic
+
+
+def test_load_traffic_skips_speculative_jobs(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(db_path)
+    params = StoryParameters(language="English", setting="Animals", moral="Kindness", culture="Indian")
+    queue.submit(params, use_agents=True)
+    queue.submit(params, use_agents=True, prefetch=True)
+    queue.cancel(queue.submit(params, use_agents=False))
+    started = queue.submit(params, use_agents=False)
+    queue.claim_next("test", include_prefetch=False)
+    queue.claim_next("test", include_prefetch=False)
+    queue.cancel(started)
+
+    traffic = load_traffic(db_path)
+
+    assert [use_agents for _, _, use_agents in traffic] == [True, False]
+    assert traffic[0][0] == 0
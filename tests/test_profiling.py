@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from src.llm.stub_server import StubConfig, start_stub_server
+from src.profiling import SamplingProfiler, carry_profile
+
+
+def _seconds(profiler: SamplingProfiler) -> dict[str, float]:
+    return {
+        profile["name"].rsplit("(", 1)[1].rstrip(")"): profile["endValue"]
+        for profile in profiler.to_speedscope()["profiles"]
+    }
+
+
+def _chat(base_url: str) -> None:
+    httpx.post(
+        f"{base_url}/chat/completions",
+        json={"model": "stub", "messages": [{"role": "user", "content": "Hello"}]},
+        timeout=10
+    ).raise_for_status()
+
+
+def test_blocked_http_read_counts_as_network():
+    server = start_stub_server(config=StubConfig(latency=0.5))
+    try:
+        profiler = SamplingProfiler("network")
+        profiler.start()
+        _chat(server.base_url)
+        profiler.stop()
+    finally:
+        server.shutdown()
+
+    seconds = _seconds(profiler)
+    assert seconds["network"] >= 0.3
+    assert seconds["network"] > seconds["wait"]
+
+
+def test_pool_threads_are_sampled_only_while_working_for_the_request():
+    server = start_stub_server(config=StubConfig(latency=0.5))
+    try:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-hedge") as pool:
+            # Another request's call on the shared pool
+            pool.submit(lambda: _chat(server.base_url))
+            profiler = SamplingProfiler("pool")
+            profiler.start()
+            pool.submit(carry_profile(lambda: time.sleep(0.3))).result()
+            profiler.stop()
+    finally:
+        server.shutdown()
+
+    seconds = _seconds(profiler)
+    assert seconds["network"] == 0
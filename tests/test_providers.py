@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from langchain_core.messages import HumanMessage
+
+from src.agents.nodes import review_stats_model
+from src.llm.providers import SERVED_MODEL, ProviderEndpoint, ProviderRouter, RoutedChatModel, RoutingConfig
+from src.llm.stub_server import StubConfig, start_stub_server
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**config) -> object:
+        server = start_stub_server(config=StubConfig(**config))
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+
+
+def _complete(router: ProviderRouter, timeout: float = 10.0) -> str:
+    def send(endpoint: ProviderEndpoint) -> str:
+        client = router.openai_client(endpoint, timeout=router.request_timeout(timeout))
+        response = client.chat.completions.create(
+            model="stub", messages=[{"role": "user", "content": "Tell me a story"}]
+        )
+        return response.choices[0].message.content
+
+    return router.run(send, label="simple")
+
+
+def test_failover_and_cooldown(servers):
+    broken, healthy = servers(fail_rate=1.0), servers()
+    router = ProviderRouter(
+        [ProviderEndpoint(name="broken", base_url=broken.base_url),
+         ProviderEndpoint(name="healthy", base_url=healthy.base_url)],
+        RoutingConfig(strategy="failover", failure_threshold=2, cooldown_seconds=60)
+    )
+
+    for _ in range(2):
+        assert "Once upon a time" in _complete(router)
+    metrics = router.metrics()["endpoints"]
+    assert metrics["broken"]["failures"] == 2
+    assert metrics["broken"]["cooling_down"]
+
+    # While cooling down the broken endpoint is not tried first anymore
+    requests_before = broken.requests
+    assert "Once upon a time" in _complete(router)
+    assert broken.requests == requests_before
+    assert router.metrics()["endpoints"]["healthy"]["calls"] == 3
+
+
+def test_hung_endpoint_fails_over_after_endpoint_timeout(servers):
+    hung, healthy = servers(latency=5.0), servers()
+    router = ProviderRouter(
+        [ProviderEndpoint(name="hung", base_url=hung.base_url),
+         ProviderEndpoint(name="healthy", base_url=healthy.base_url)],
+        RoutingConfig(strategy="failover", endpoint_timeout=0.5)
+    )
+
+    started = time.monotonic()
+    assert "Once upon a time" in _complete(router)
+    assert time.monotonic() - started < 4.0
+    assert router.metrics()["endpoints"]["hung"]["failures"] == 1
+
+
+def test_latency_routing_prefers_faster_endpoint(servers):
+    slow, fast = servers(latency=0.3), servers()
+    router = ProviderRouter(
+        [ProviderEndpoint(name="slow", base_url=slow.base_url),
+         ProviderEndpoint(name="fast", base_url=fast.base_url)],
+        RoutingConfig(strategy="latency")
+    )
+
+    for _ in range(6):
+        _complete(router)
+    # Each endpoint is measured once, then the faster one takes the traffic
+    assert slow.requests == 1
+    assert fast.requests == 5
+
+
+def test_responses_report_the_model_that_served_them(servers):
+    broken, local = servers(fail_rate=1.0), servers()
+    router = ProviderRouter(
+        [ProviderEndpoint(name="openai", base_url=broken.base_url),
+         ProviderEndpoint(name="local", base_url=local.base_url, model="llama-local")],
+        RoutingConfig(strategy="failover")
+    )
+    llm = RoutedChatModel(router, model="gpt-5-mini", temperature=0.7, label="writer")
+    messages = [HumanMessage(content="Tell me a story")]
+
+    assert llm.invoke(messages).response_metadata[SERVED_MODEL] == "llama-local"
+    chunks = list(llm.stream(messages))
+    assert chunks[0].response_metadata[SERVED_MODEL] == "llama-local"
+
+    assert review_stats_model("gpt-5-mini", "gpt-5-mini") == "gpt-5-mini"
+    assert review_stats_model("llama-local", "gpt-5-mini") == "llama-local reviewed by gpt-5-mini"
@@ -0,0 +1,31 @@
+from src import gpt_commands, storage
+from src.agents import graph
+
+
+def _fail_planner(monkeypatch, writer_calls: list):
+    monkeypatch.setattr(graph, "plan_story", lambda state, **kwargs: {
+        "error": "Planning failed: bad JSON", "current_stage": "error"
+    })
+    monkeypatch.setattr(graph, "write_story", lambda state, **kwargs: writer_calls.append(state) or {})
+
+
+def test_failed_pipeline_falls_back_to_simple_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DATA_DIR", tmp_path)
+    writer_calls = []
+    _fail_planner(monkeypatch, writer_calls)
+    monkeypatch.setattr(gpt_commands, "generate_story_simple", lambda *args, **kwargs: "A simple story.")
+
+    stages = list(gpt_commands.generate_story_stream("English", "Animals", "Sharing", "Indian", prefetch=True))
+
+    assert writer_calls == []
+    assert stages[-1] == ("fallback", {"final_story": "A simple story.", "current_stage": "complete"})
+
+
+def test_failed_fallback_yields_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "DATA_DIR", tmp_path)
+    _fail_planner(monkeypatch, [])
+    monkeypatch.setattr(gpt_commands, "generate_story_simple", lambda *args, **kwargs: None)
+
+    stages = list(gpt_commands.generate_story_stream("English", "Animals", "Sharing", "Indian", prefetch=True))
+
+    assert stages[-1][0] == "error"